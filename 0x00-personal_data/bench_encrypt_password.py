@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Benchmark of bulk password hashing and verification throughput
+depending on the number of workers
+
+Usage: ./bench_encrypt_password.py [count] [rounds]
+"""
+import os
+import sys
+import time
+from encrypt_password import hash_passwords, verify_many
+
+
+def main() -> None:
+    """ Prints hashes/sec and verifications/sec per worker count """
+    count: int = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    rounds: int = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    passwords = [f"password-{i}" for i in range(count)]
+    cpus: int = os.cpu_count() or 1
+
+    print(f"{count} passwords, {rounds} rounds, {cpus} CPUs")
+    print(f"{'workers':>8} {'hash/s':>10} {'verify/s':>10}")
+    workers: int = 1
+    while workers <= cpus * 2:
+        start: float = time.perf_counter()
+        hashes = list(hash_passwords(passwords, workers, rounds))
+        hash_rate: float = count / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        assert all(verify_many(zip(hashes, passwords), workers))
+        verify_rate: float = count / (time.perf_counter() - start)
+
+        print(f"{workers:>8} {hash_rate:>10.1f} {verify_rate:>10.1f}")
+        workers *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,19 @@
 #!/usr/bin/env python3
 """ This script functions for hashing user password """
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Tuple
 import bcrypt
+import os
 
 
-def hash_password(password: str) -> bytes:
+DEFAULT_ROUNDS: int = 12
+
+
+def hash_password(password: str, rounds: int = DEFAULT_ROUNDS) -> bytes:
     """ Generate salted, hashed password """
     byte: bytes = password.encode()
-    salt: bytes = bcrypt.gensalt()
+    salt: bytes = bcrypt.gensalt(rounds)
     hashed_password: bytes = bcrypt.hashpw(byte, salt)
 
     return hashed_password
@@ -15,3 +22,44 @@ def hash_password(password: str) -> bytes:
 def is_valid(hashed_password: bytes, password: str) -> bool:
     """ Checks if the plain text password matches the hashed password """
     return bcrypt.checkpw(password.encode(), hashed_password)
+
+
+def _ordered_map(pool: Executor, func: Callable, items: Iterable,
+                 window: int) -> Iterator:
+    """
+    Yields func(item) for each item in order, keeping at most window
+    calls in flight so items are consumed lazily
+    """
+    pending: deque = deque()
+    for item in items:
+        pending.append(pool.submit(func, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def hash_passwords(passwords: Iterable[str], workers: int = None,
+                   rounds: int = DEFAULT_ROUNDS) -> Iterator[bytes]:
+    """
+    Hashes passwords on a pool of workers threads (bcrypt releases the
+    GIL, default: one per CPU) and yields the hashes in the order of
+    passwords
+    """
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(workers) as pool:
+        yield from _ordered_map(
+            pool, lambda password: hash_password(password, rounds),
+            passwords, workers * 2)
+
+
+def verify_many(pairs: Iterable[Tuple[bytes, str]],
+                workers: int = None) -> Iterator[bool]:
+    """
+    Checks (hashed_password, password) pairs on a pool of workers threads
+    and yields the results in the order of pairs
+    """
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(workers) as pool:
+        yield from _ordered_map(pool, lambda pair: is_valid(*pair),
+                                pairs, workers * 2)
@@ -3,21 +3,56 @@
 This script contains functions and classes
 for logging user data Redactingly
 """
-from typing import List, Tuple, cast
+from functools import lru_cache
+from typing import Iterable, List, Tuple, cast
+import argparse
+import atexit
+import copy
+import queue
 import re
 import logging
 import os
+import threading
+import time
 import mysql.connector
 
 
 PII_FIELDS: Tuple = ('name', 'ssn', 'password', 'email', 'phone')
+DEFAULT_BATCH_SIZE: int = 1000
+
+
+class Redactor:
+    """ Obfuscates fields of messages with a pattern compiled once """
+
+    def __init__(self, fields: Tuple[str, ...], redaction: str,
+                 seperator: str):
+        """ Compiles the pattern matching fields values """
+        self.pattern: re.Pattern = re.compile(
+            rf'({"|".join(fields)})=[^{seperator}]+')
+        self.replacement: str = rf'\1={redaction}'
+
+    def redact(self, message: str) -> str:
+        """ Returns message obfuscated """
+        return cast(str, self.pattern.sub(self.replacement, message))
+
+    def redact_many(self, messages: Iterable[str]) -> List[str]:
+        """ Returns every message of messages obfuscated, in order """
+        sub = self.pattern.sub
+        replacement = self.replacement
+        return [sub(replacement, message) for message in messages]
+
+
+@lru_cache(maxsize=128)
+def get_redactor(fields: Tuple[str, ...], redaction: str,
+                 seperator: str) -> Redactor:
+    """ Returns the Redactor of a (fields, redaction, seperator) set """
+    return Redactor(fields, redaction, seperator)
 
 
 def filter_datum(fields: List[str], redaction: str,
                  message: str, seperator: str) -> str:
     """ Returns the log message obfuscated """
-    return cast(str, re.sub(rf'({"|".join(fields)})=[^{seperator}]+',
-                rf'\1={redaction}', message))
+    return get_redactor(tuple(fields), redaction, seperator).redact(message)
 
 
 class RedactingFormatter(logging.Formatter):
@@ -31,22 +66,135 @@ class RedactingFormatter(logging.Formatter):
         """ Initializies instance """
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
+        self.redactor: Redactor = get_redactor(tuple(fields), self.REDACTION,
+                                               self.SEPERATOR)
 
     def format(self, record: logging.LogRecord) -> str:
         """ Return formatted log record """
-        message: str = filter_datum(self.fields, self.REDACTION,
-                                    record.msg, self.SEPERATOR)
+        message: str = self.redactor.redact(record.msg)
         record.msg = message
         return super(RedactingFormatter, self).format(record)
 
 
-def get_logger() -> logging.Logger:
-    """ Returns a Logger object """
+class QueueingHandler(logging.Handler):
+    """
+    Hands log records to a worker thread through a bounded queue: the
+    wrapped handler formats (and redacts) and writes them on that thread,
+    so the logging thread only pays for an enqueue.
+
+    overflow decides what happens when the queue is full:
+        - 'block': wait for room
+        - 'drop-oldest': discard the oldest queued record
+        - 'drop-newest': discard the incoming record
+    Discarded records are counted in dropped_oldest and dropped_newest.
+
+    Records are prepared on the logging thread before being queued: their
+    message is merged with its args and their exception rendered, so
+    later changes to the args can't alter them.
+    """
+    OVERFLOW_POLICIES: Tuple = ('block', 'drop-oldest', 'drop-newest')
+
+    def __init__(self, handler: logging.Handler, maxsize: int = 10000,
+                 overflow: str = 'block'):
+        """ Initializes instance and starts the worker thread """
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        super(QueueingHandler, self).__init__()
+        self.handler: logging.Handler = handler
+        self.overflow: str = overflow
+        self.queue: queue.Queue = queue.Queue(maxsize)
+        self.dropped_oldest: int = 0
+        self.dropped_newest: int = 0
+        self._worker: threading.Thread = threading.Thread(
+            target=self._work, name='QueueingHandler', daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+
+    def _work(self) -> None:
+        """ Handles queued records until the None sentinel """
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            self.handler.handle(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Returns a copy of record with its args merged into its message
+        and its exception rendered to exc_text, as QueueHandler.prepare
+        does; the wrapped handler still formats (and redacts) the whole
+        """
+        message = record.getMessage()
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = logging.Formatter().formatException(record.exc_info)
+        record = copy.copy(record)
+        record.msg = message
+        record.args = None
+        record.exc_info = None
+        record.exc_text = exc_text
+        return record
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """ Queues record, prepared, according to the overflow policy """
+        try:
+            record = self.prepare(record)
+            if self.overflow == 'block':
+                self.queue.put(record)
+                return
+            while True:
+                try:
+                    self.queue.put_nowait(record)
+                    return
+                except queue.Full:
+                    if self.overflow == 'drop-newest':
+                        with self.lock:
+                            self.dropped_newest += 1
+                        return
+                try:
+                    self.queue.get_nowait()
+                    with self.lock:
+                        self.dropped_oldest += 1
+                except queue.Empty:
+                    pass
+        except Exception:
+            self.handleError(record)
+
+    def close(self) -> None:
+        """ Flushes queued records and stops the worker thread """
+        if self._worker.is_alive():
+            self.queue.put(None)
+            self._worker.join()
+            self.handler.close()
+        super(QueueingHandler, self).close()
+
+
+def get_logger(queue_size: int = None, overflow: str = None) -> logging.Logger:
+    """
+    Returns a Logger object
+
+    Records are redacted and written synchronously unless queue_size
+    (default: PERSONAL_DATA_LOG_QUEUE_SIZE, 0) is positive, in which case
+    it is done on a worker thread through a QueueingHandler of that size
+    using the overflow policy (default: PERSONAL_DATA_LOG_OVERFLOW, block).
+    The logger is only configured by the first call.
+    """
     new_logger: logging.Logger = logging.getLogger('user_data')
+    if new_logger.handlers:
+        return new_logger
+
+    if queue_size is None:
+        queue_size = int(os.getenv('PERSONAL_DATA_LOG_QUEUE_SIZE', '0'))
+    if overflow is None:
+        overflow = os.getenv('PERSONAL_DATA_LOG_OVERFLOW', 'block')
+
     new_logger.setLevel(logging.INFO)
     new_logger.propagate = False
     console_handler: logging.Handler = logging.StreamHandler()
     console_handler.setFormatter(RedactingFormatter(fields=list(PII_FIELDS)))
+    if queue_size > 0:
+        console_handler = QueueingHandler(console_handler, queue_size,
+                                          overflow)
     new_logger.addHandler(console_handler)
 
     return new_logger
@@ -71,27 +219,55 @@ def get_db() -> mysql.connector.connection.MySQLConnection:
     return db
 
 
-def main() -> None:
-    """ Main function """
-    db: mysql.connector.connection.MYSQLConnection = get_db()
-    cursor: mysql.connector.cursor.MySQLCursor = db.cursor()
+def export_users(db, logger: logging.Logger,
+                 batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """
+    Logs every row of the users table, fetching batch_size rows at a
+    time so memory stays flat whatever the size of the table.
+    db can be any DB-API connection (MySQL, SQLite...).
+    Returns the number of rows logged
+    """
+    cursor = db.cursor()
     cursor.execute('SELECT * FROM users;')
 
-    logger: logging.Logger = get_logger()
-
     if cursor.description is not None:
         columns = []
         for column_desc in cursor.description:
             columns.append(column_desc[0])
 
-    for row in cursor.fetchall():
-        message = '; '.join(f"{col}={value}" for col, value
-                            in zip(columns, row))
-        logger.info(message)
+    count: int = 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            message = '; '.join(f"{col}={value}" for col, value
+                                in zip(columns, row))
+            logger.info(message)
+        count += len(rows)
 
     cursor.close()
+    return count
+
+
+def main(argv: List[str] = None) -> None:
+    """ Main function """
+    parser = argparse.ArgumentParser(description='Log the users table')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='number of rows fetched at a time')
+    args = parser.parse_args(argv)
+
+    db: mysql.connector.connection.MYSQLConnection = get_db()
+    logger: logging.Logger = get_logger()
+
+    start: float = time.perf_counter()
+    count: int = export_users(db, logger, args.batch_size)
+    elapsed: float = time.perf_counter() - start
     db.close()
 
+    rate: float = count / elapsed if elapsed > 0 else 0.0
+    print(f"{count} rows in {elapsed:.2f}s ({rate:.0f} rows/sec)")
+
 
 if __name__ == '__main__':
     main()
@@ -3,6 +3,7 @@
 Route module for the API
 """
 from os import getenv
+from api.v1.auth.auth import PathMatcher
 from api.v1.views import app_views
 from flask import Flask, jsonify, abort, request
 from flask_cors import (CORS, cross_origin)
@@ -14,6 +15,12 @@ app.register_blueprint(app_views)
 CORS(app, resources={r"/api/v1/*": {"origins": "*"}})
 auth = None
 
+# Paths that don't require authentication
+EXCLUDED_PATHS = ['/api/v1/status/',
+                  '/api/v1/unauthorized/',
+                  '/api/v1/forbidden/']
+excluded_paths = PathMatcher(EXCLUDED_PATHS)
+
 AUTH_TYPE = os.getenv('AUTH_TYPE')
 if AUTH_TYPE == 'auth':
     from api.v1.auth.auth import Auth
@@ -22,6 +29,15 @@ elif AUTH_TYPE == 'basic_auth':
     from api.v1.auth.basic_auth import BasicAuth
     auth = BasicAuth()
 
+# '1': record the duration of each stage of requests, served in Prometheus
+#      text format at /api/v1/metrics
+API_METRICS = os.getenv('API_METRICS') == '1'
+# '1': add the stage durations of each request in a Server-Timing header
+API_SERVER_TIMING = os.getenv('API_SERVER_TIMING') == '1'
+if API_METRICS or API_SERVER_TIMING:
+    from api.v1.metrics import init_app
+    init_app(app, auth, API_METRICS, API_SERVER_TIMING)
+
 
 @app.errorhandler(401)
 def unauthorized(error) -> str:
@@ -64,19 +80,17 @@ def before_request():
         - requested path is in excluded_paths
     """
     if auth:
-        # Define paths that don't require authentication
-        excluded_paths = ['/api/v1/status/',
-                          '/api/v1/unauthorized/',
-                          '/api/v1/forbidden/']
-        if auth.require_auth(request.path, excluded_paths):
+        if not excluded_paths.matches(request.path):
             # Verify authorization header exists
             # Return 401 Unauthorized if missing or invalid
-            if auth.authorization_header(request) is None:
+            authorization_header = auth.authorization_header(request)
+            if authorization_header is None:
                 abort(401)
 
             # Verify current user exists and has permission
             # Return 403 Forbidden if user not found or lacks permission
-            if auth.current_user(request) is None:
+            # The header is passed along so it's only read once
+            if auth.current_user(request, authorization_header) is None:
                 abort(403)
 
 
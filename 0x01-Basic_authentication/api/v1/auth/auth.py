@@ -1,10 +1,49 @@
 #!/usr/bin/env python3
 """ This module contains the Auth class """
 from flask import request
-from typing import List, TypeVar
+from functools import lru_cache
+from typing import Iterable, List, TypeVar
+import re
 import werkzeug
 
 
+class PathMatcher:
+    """
+    Matches request paths against a list of excluded paths, compiled once
+    into a single regular expression.
+
+    Supported entries:
+        - exact paths, trailing-slash insensitive:
+          '/api/v1/status/' matches '/api/v1/status' and '/api/v1/status/'
+        - wildcards ending with '*', matching any path with that prefix:
+          '/api/v1/stat*' matches '/api/v1/stats' and '/api/v1/status'
+    """
+    def __init__(self, excluded_paths: Iterable[str]):
+        """ Compiles excluded_paths """
+        self.excluded_paths = tuple(excluded_paths)
+        alternatives = []
+        for excluded_path in self.excluded_paths:
+            if excluded_path.endswith('*'):
+                alternatives.append(re.escape(excluded_path[:-1]))
+            else:
+                alternatives.append(
+                    re.escape(excluded_path.rstrip('/')) + '/?$')
+        self._regex = re.compile('|'.join(alternatives)) \
+            if alternatives else None
+
+    def matches(self, path: str) -> bool:
+        """ Returns True if path is one of the excluded paths """
+        if self._regex is None or path is None:
+            return False
+        return self._regex.match(path) is not None
+
+
+@lru_cache(maxsize=32)
+def _path_matcher(excluded_paths: tuple) -> PathMatcher:
+    """ Returns the PathMatcher of excluded_paths, built once """
+    return PathMatcher(excluded_paths)
+
+
 class Auth:
     """
     Authentication utility class that provides methods for handling
@@ -31,30 +70,18 @@ class Auth:
                  excluded_paths.
 
         Note:
-            This method normalizes both the input path and excluded paths by
-            ensuring they end with a forward slash '/'.
+            Matching ignores trailing slashes and supports '*' wildcards,
+            see PathMatcher. The matcher of each excluded_paths list is
+            compiled once and reused.
             Example:
-                path = '/api/v1/users' becomes '/api/v1/users/'
-                excluded_paths = ['/api/v1/status'] becomes ['/api/v1/status/']
+                '/api/v1/users' and '/api/v1/users/' are the same path
+                '/api/v1/stat*' excludes '/api/v1/stats' and '/api/v1/status'
         """
-        import re
         if excluded_paths is None or len(excluded_paths) == 0 or\
                 path is None or len(path) == 0:
             return True
 
-        for excluded_path in excluded_paths:
-            if excluded_path.endswith('*'):
-                path_pattern = rf"{excluded_path[:-1]}.*"
-            else:
-                if not path.endswith('/'):
-                    path += '/'
-                if not excluded_path.endswith('/'):
-                    excluded_path += '/'
-                path_pattern = rf"{excluded_path}"
-            if re.match(path_pattern, path):
-                return False
-
-        return True
+        return not _path_matcher(tuple(excluded_paths)).matches(path)
 
     def authorization_header(self, request=None) -> str:
         """
@@ -78,13 +105,16 @@ class Auth:
 
         return None
 
-    def current_user(self, request=None):
+    def current_user(self, request=None, authorization_header: str = None):
         """
         Retrieves the current authenticated user based on the request context.
 
         Args:
             request (Optional[Request]): Flask request object containing HTTP
                                        request information.
+            authorization_header (Optional[str]): The Authorization header
+                                       of request, if the caller already
+                                       read it.
 
         Returns:
             Optional[object]: None by default. This method is meant to be
@@ -1,9 +1,18 @@
 #!/usr/bin/env python3
 """ This module contains the BasicAuth class """
 from api.v1.auth.auth import Auth
+from collections import OrderedDict
+from flask import g, has_request_context
+from os import getenv
 import base64
 import binascii
+import hashlib
+import hmac
+import os
+import threading
+import time
 from typing import Tuple, TypeVar
+from models import hashers
 from models.user import User
 
 
@@ -17,7 +26,125 @@ class BasicAuth(Auth):
     2. Decoding the Base64 authorization header to retrieve credentials
 
     Inherits from Auth class to maintain authentication framework consistency.
+
+    Verified Authorization headers are kept in a bounded, TTL-based cache
+    mapping a keyed digest of the header to the user id, so repeated
+    requests skip decoding, searching and hashing. Rejected headers are
+    kept in a separate cache of the same kind, so floods of invalid
+    headers don't evict valid ones, and repeated bad passwords don't
+    cost a password hash each. Plain passwords are never stored.
+
+    Headers longer than MAX_HEADER_LENGTH are rejected before any
+    decoding, and the outcome of a request is kept on flask.g, so the
+    header is parsed once per request. Unknown emails are rejected
+    without hashing anything; with HIDE_UNKNOWN_EMAILS their password is
+    checked against a dummy hash instead, so they're rejected as slowly
+    as a wrong password and response times don't reveal which emails
+    exist (at the cost of a full hash per distinct unknown email).
     """
+    CACHE_SIZE: int = int(getenv('BASIC_AUTH_CACHE_SIZE', '1024'))
+    CACHE_TTL: float = float(getenv('BASIC_AUTH_CACHE_TTL', '300'))
+    REJECTED_CACHE_SIZE: int = int(
+        getenv('BASIC_AUTH_REJECTED_CACHE_SIZE', '1024'))
+    MAX_HEADER_LENGTH: int = int(getenv('BASIC_AUTH_MAX_LENGTH', '1024'))
+    HIDE_UNKNOWN_EMAILS: bool = \
+        getenv('BASIC_AUTH_HIDE_UNKNOWN_EMAILS', '0') == '1'
+
+    def __init__(self):
+        """ Initializes the verified and rejected credential caches """
+        self._cache_key = os.urandom(32)
+        self._cache = OrderedDict()
+        self._rejected = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def _credentials_digest(self, authorization_header: str) -> bytes:
+        """
+        Returns a keyed digest of the Authorization header, usable as a
+        cache key without keeping the credentials themselves.
+        """
+        return hmac.new(self._cache_key, authorization_header.encode(),
+                        hashlib.sha256).digest()
+
+    @staticmethod
+    def _same_hash(stored: str, cached: str) -> bool:
+        """ Compares two password hashes (or None) in constant time """
+        if stored is None or cached is None:
+            return stored is cached
+        return hmac.compare_digest(stored, cached)
+
+    def _cached_user(self, digest: bytes) -> TypeVar('User'):
+        """
+        Returns the User cached for digest, or None if there is no entry,
+        it expired, the user was removed or its password changed.
+        """
+        with self._cache_lock:
+            entry = self._cache.get(digest)
+        if entry is None:
+            return None
+        user_id, password, expires_at = entry
+        # Looked up without the lock, which only guards the cache
+        user = User.get(user_id)
+        valid = time.monotonic() <= expires_at and user is not None and\
+            self._same_hash(user.password, password)
+        with self._cache_lock:
+            if self._cache.get(digest) is entry:
+                if valid:
+                    self._cache.move_to_end(digest)
+                else:
+                    del self._cache[digest]
+        return user if valid else None
+
+    def _cache_user(self, digest: bytes, user: TypeVar('User')) -> None:
+        """ Caches user for digest, evicting the least recently used entry """
+        with self._cache_lock:
+            self._cache[digest] = (user.id, user.password,
+                                   time.monotonic() + self.CACHE_TTL)
+            self._cache.move_to_end(digest)
+            while len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    @staticmethod
+    def _password_of(email: str) -> str:
+        """ Returns the password hash of the user of email, None if there
+        is no such user """
+        users = BasicAuth._users_of(email)
+        return users[0].password if len(users) > 0 else None
+
+    def _is_rejected(self, digest: bytes) -> bool:
+        """
+        Returns True if the header of digest was rejected and would still
+        be: the user of its email still has the password hash (or still
+        doesn't exist) it was rejected with.
+        """
+        with self._cache_lock:
+            entry = self._rejected.get(digest)
+        if entry is None:
+            return False
+        email, password, expires_at = entry
+        rejected = time.monotonic() <= expires_at and\
+            self._same_hash(self._password_of(email), password)
+        with self._cache_lock:
+            if self._rejected.get(digest) is entry:
+                if rejected:
+                    self._rejected.move_to_end(digest)
+                else:
+                    del self._rejected[digest]
+        return rejected
+
+    def _cache_rejected(self, digest: bytes, email: str,
+                        password: str) -> None:
+        """
+        Caches the rejection of the credentials of email with digest,
+        checked against the password hash password (None if the user
+        didn't exist), evicting the least recently used entry
+        """
+        with self._cache_lock:
+            self._rejected[digest] = (email, password,
+                                      time.monotonic() + self.CACHE_TTL)
+            self._rejected.move_to_end(digest)
+            while len(self._rejected) > self.REJECTED_CACHE_SIZE:
+                self._rejected.popitem(last=False)
+
     def extract_base64_authorization_header(self,
                                             authorization_header: str) -> str:
         """
@@ -55,13 +182,14 @@ class BasicAuth(Auth):
                 (typically in the format "username:password") or None
         """
         if base64_authorization_header is None or\
-                type(base64_authorization_header) is not str:
+                type(base64_authorization_header) is not str or\
+                len(base64_authorization_header) > self.MAX_HEADER_LENGTH:
             return None
 
         try:
             header_byte = base64_authorization_header.encode('utf-8')
             header_str = base64.b64decode(header_byte).decode('utf-8')
-        except binascii.Error:
+        except (binascii.Error, UnicodeError):
             return None
 
         return header_str
@@ -114,21 +242,36 @@ class BasicAuth(Auth):
                 user_pwd is None or type(user_pwd) is not str:
             return None
 
+        return self._check_password(self._users_of(user_email), user_pwd)
+
+    @staticmethod
+    def _users_of(email: str) -> list:
+        """ Returns the users of email """
         try:
-            result = User.search({'email': user_email})
+            return User.search({'email': email})
         except KeyError:
-            return None
+            return []
 
-        if len(result) == 0:
+    def _check_password(self, users: list, user_pwd: str) -> TypeVar('User'):
+        """
+        Returns the first of users (the ones of an email) if user_pwd is
+        its password, None otherwise
+        """
+        user = users[0] if len(users) > 0 else None
+        if user is None or user.password is None or\
+                hashers.identify(user.password) is None:
+            if self.HIDE_UNKNOWN_EMAILS:
+                # As slow as a wrong password, not to reveal the email
+                hashers.verify_dummy(user_pwd)
             return None
 
-        user = result[0]
         if not user.is_valid_password(user_pwd):
             return None
 
         return user
 
-    def current_user(self, request=None) -> TypeVar('User'):
+    def current_user(self, request=None,
+                     authorization_header: str = None) -> TypeVar('User'):
         """
         Retrieves the User instance for a request using Basic authentication.
 
@@ -138,9 +281,15 @@ class BasicAuth(Auth):
         3. Separates email and password
         4. Validates credentials and returns corresponding User
 
+        Headers too long, or not Basic ones, are rejected before any
+        decoding; the outcome is kept on flask.g for the rest of the
+        request.
+
         Args:
             request: The HTTP request object containing the authorization
                 header. Defaults to None
+            authorization_header: The Authorization header of request, if
+                the caller already read it. Defaults to None
 
         Returns:
             TypeVar('User'): A User instance if authentication succeeds or None
@@ -148,14 +297,57 @@ class BasicAuth(Auth):
         if request is None:
             return None
 
-        authorization_header = self.authorization_header(request)
+        if authorization_header is None:
+            authorization_header = self.authorization_header(request)
+        if authorization_header is None or\
+                len(authorization_header) > self.MAX_HEADER_LENGTH:
+            return None
+
+        in_request = has_request_context()
+        if in_request:
+            outcome = g.get('basic_auth_outcome')
+            if outcome is not None and outcome[0] == authorization_header:
+                return outcome[1]
+        user = self._authenticate(authorization_header)
+        if in_request:
+            g.basic_auth_outcome = (authorization_header, user)
+        return user
+
+    def _authenticate(self, authorization_header: str) -> TypeVar('User'):
+        """
+        Returns the User of an Authorization header, from the caches when
+        possible, caching the outcome otherwise.
+        """
         base64_authorization_header = self.extract_base64_authorization_header(
             authorization_header)
+        if base64_authorization_header is None:
+            return None
+
+        digest = None
+        if self.CACHE_SIZE > 0 or self.REJECTED_CACHE_SIZE > 0:
+            digest = self._credentials_digest(authorization_header)
+            if self.CACHE_SIZE > 0:
+                user = self._cached_user(digest)
+                if user is not None:
+                    return user
+            if self.REJECTED_CACHE_SIZE > 0 and self._is_rejected(digest):
+                return None
+
         decoded_authorization_header = self.decode_base64_authorization_header(
             base64_authorization_header)
-        user_credentials = self.extract_user_credentials(
+        user_email, user_pwd = self.extract_user_credentials(
             decoded_authorization_header)
-        user = self.user_object_from_credentials(user_credentials[0],
-                                                 user_credentials[1])
+        if user_email is None or user_pwd is None:
+            return None
+
+        users = self._users_of(user_email)
+        # Hash the password is checked against, for the rejected cache
+        previous = users[0].password if len(users) > 0 else None
+        user = self._check_password(users, user_pwd)
+        if user is not None:
+            if digest is not None and self.CACHE_SIZE > 0:
+                self._cache_user(digest, user)
+        elif digest is not None and self.REJECTED_CACHE_SIZE > 0:
+            self._cache_rejected(digest, user_email, previous)
 
         return user
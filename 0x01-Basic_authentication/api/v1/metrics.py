@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+""" This module contains the opt-in request instrumentation """
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, Iterable, List, Tuple
+import threading
+import time
+from flask import Flask, Response, g, request
+import flask.json
+
+
+# Upper bounds (seconds) of the histogram buckets, +Inf is implicit
+BUCKETS: Tuple[float, ...] = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                              0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Quantiles of the stage durations estimated at /api/v1/metrics
+QUANTILES: Tuple[float, ...] = (0.5, 0.9, 0.99)
+
+# Seconds spent in each stage by the current request, None outside of
+# an instrumented request
+_timings: ContextVar = ContextVar('timings', default=None)
+
+
+class Histogram:
+    """
+    Prometheus-style histogram of durations: a count per bucket, the
+    number of observations and their sum, per label values.
+    """
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...],
+                 buckets: Tuple[float, ...] = BUCKETS):
+        """ Initializes an empty histogram """
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        """ Records one duration of the series of label_values """
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # [count per bucket (last one is +Inf), count, sum]
+                series = [[0] * (len(self.buckets) + 1), 0, 0.0]
+                self._series[label_values] = series
+            series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def quantile(self, q: float, *label_values: str) -> float:
+        """
+        Estimates the q quantile of a series, interpolating inside the
+        bucket it falls in, as PromQL's histogram_quantile() does.
+        Returns None if the series is empty.
+        """
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                return None
+            counts, total = list(series[0]), series[1]
+        rank = q * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            if cumulative + count >= rank and count > 0:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return None
+
+    def exposition(self) -> List[str]:
+        """ Returns the lines of the histogram in Prometheus text format """
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            series = sorted((key, [list(value[0]), value[1], value[2]])
+                            for key, value in self._series.items())
+        for label_values, (counts, total, value_sum) in series:
+            labels = ','.join('{}="{}"'.format(name, _escape(value))
+                              for name, value in zip(self.labels,
+                                                     label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('{}_bucket{{{}}} {}'.format(
+                    self.name, ','.join(filter(None, (
+                        labels, 'le="{}"'.format(le)))), cumulative))
+            suffix = '{{{}}}'.format(labels) if labels else ''
+            lines.append('{}_count{} {}'.format(self.name, suffix, total))
+            lines.append('{}_sum{} {!r}'.format(self.name, suffix, value_sum))
+        return lines
+
+    def quantiles_exposition(self, qs: Iterable[float]) -> List[str]:
+        """
+        Returns the estimated qs quantiles of every series as a gauge in
+        Prometheus text format, for readers without histogram_quantile()
+        """
+        name = self.name.replace('_seconds', '_quantile_seconds')
+        lines = ['# HELP {} Estimated quantiles of {}.'.format(
+                     name, self.name),
+                 '# TYPE {} gauge'.format(name)]
+        with self._lock:
+            keys = sorted(self._series)
+        for label_values in keys:
+            labels = ''.join('{}="{}",'.format(label, _escape(value))
+                             for label, value in zip(self.labels,
+                                                     label_values))
+            for q in qs:
+                lines.append('{}{{{}quantile="{}"}} {!r}'.format(
+                    name, labels, q, self.quantile(q, *label_values)))
+        return lines
+
+
+def _escape(value: str) -> str:
+    """ Escapes a label value for the Prometheus text format """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')\
+        .replace('\n', '\\n')
+
+
+REQUEST_DURATION = Histogram(
+    'api_request_duration_seconds', 'Duration of HTTP requests.',
+    ('method', 'endpoint', 'status'))
+STAGE_DURATION = Histogram(
+    'api_stage_duration_seconds',
+    'Time spent in each stage of HTTP requests.', ('stage',))
+
+
+def timed(stage: str, function: Callable) -> Callable:
+    """
+    Wraps function so calls made during an instrumented request add their
+    duration to stage. Nested calls of the same stage (e.g. a storage
+    method calling another) are only counted once.
+    """
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        timings = _timings.get()
+        if timings is None or stage in timings[1]:
+            return function(*args, **kwargs)
+        timings[1].add(stage)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings[0][stage] = timings[0].get(stage, 0.0) + \
+                time.perf_counter() - start
+            timings[1].discard(stage)
+    return wrapper
+
+
+def instrument(obj, names: Iterable[str], stage: str) -> None:
+    """ Replaces the methods names of obj (class or instance) by timed ones """
+    for name in names:
+        if hasattr(obj, name):
+            attribute = obj.__dict__.get(name) if isinstance(obj, type) \
+                else None
+            if isinstance(attribute, (classmethod, staticmethod)):
+                setattr(obj, name, type(attribute)(
+                    timed(stage, attribute.__func__)))
+            else:
+                setattr(obj, name, timed(stage, getattr(obj, name)))
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """ Returns the Server-Timing header value of timings (in seconds) """
+    return ', '.join('{};dur={:.3f}'.format(stage, seconds * 1000)
+                     for stage, seconds in timings.items())
+
+
+def init_app(app: Flask, auth, metrics: bool = True,
+             header: bool = False) -> None:
+    """
+    Instruments app and auth: records the time spent in each stage of
+    every request, exposes the aggregated histograms at /api/v1/metrics
+    if metrics, and adds a Server-Timing header to responses if header.
+
+    Stages: auth (the whole authentication) and, inside it, auth_parse,
+    lookup (model reads) and password_verify; view; serialization;
+    persistence (model writes); total.
+    """
+    from models import base
+    from models.base import Base
+    from models.user import User
+
+    if auth is not None:
+        instrument(auth, ('current_user',), 'auth')
+        instrument(auth, ('extract_base64_authorization_header',
+                          'decode_base64_authorization_header',
+                          'extract_user_credentials'), 'auth_parse')
+    instrument(base.storage, ('get', 'search', 'count', 'page'), 'lookup')
+    instrument(base.storage, ('put', 'delete', 'flush', '_append_log',
+                              '_flush_file'), 'persistence')
+    instrument(User, ('is_valid_password',), 'password_verify')
+    instrument(Base, ('to_json', 'to_json_text'), 'serialization')
+    provider = getattr(app, 'json', None)
+    if provider is not None:
+        # Flask >= 2.2: jsonify() goes through the app's JSON provider
+        instrument(provider, ('response',), 'serialization')
+    else:
+        instrument(flask.json, ('dumps',), 'serialization')
+
+    if metrics:
+        def metrics_view() -> Response:
+            """ GET /api/v1/metrics
+            Return:
+              - request and stage durations, Prometheus text format
+            """
+            lines = REQUEST_DURATION.exposition() + \
+                STAGE_DURATION.exposition() + \
+                STAGE_DURATION.quantiles_exposition(QUANTILES)
+            return Response('\n'.join(lines) + '\n',
+                            mimetype='text/plain; version=0.0.4')
+        app.add_url_rule('/api/v1/metrics', 'metrics', metrics_view,
+                         strict_slashes=False)
+
+    for endpoint, view in list(app.view_functions.items()):
+        if endpoint != 'static':
+            app.view_functions[endpoint] = timed('view', view)
+
+    def start() -> None:
+        """ Starts timing the request """
+        g.metrics_start = time.perf_counter()
+        _timings.set(({}, set()))
+
+    def finish(response: Response) -> Response:
+        """ Records the timings of the request """
+        timings = _timings.get()
+        if timings is None:
+            return response
+        stages = dict(timings[0])
+        stages['total'] = time.perf_counter() - g.metrics_start
+        _timings.set(None)
+        for stage, seconds in stages.items():
+            STAGE_DURATION.observe(seconds, stage)
+        REQUEST_DURATION.observe(stages['total'], request.method,
+                                 request.endpoint or 'none',
+                                 str(response.status_code))
+        if header:
+            response.headers['Server-Timing'] = server_timing(stages)
+        return response
+
+    app.before_request_funcs.setdefault(None, []).insert(0, start)
+    app.after_request(finish)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+""" This module contains the cache of versioned JSON responses """
+from collections import OrderedDict
+from os import getenv
+from typing import Callable, Hashable, Tuple, Union
+import threading
+from flask import Response, request
+
+
+class ResponseCache:
+    """
+    LRU cache of response bodies, bounded by their total size.
+
+    An entry is kept per path with the version of the data its body was
+    built from: asking with another version drops it, and putting a body
+    of a new version replaces it, so stale bodies never pile up.
+    """
+    def __init__(self, max_size: int):
+        """ Initializes an empty cache of bodies of at most max_size
+        characters in total """
+        self.max_size = max_size
+        self.size = 0
+        # {key: (version, body, headers)}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, version: str):
+        """ Returns the (body, headers) cached for key at version, None if
+        there is none """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != version:
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1:]
+
+    def put(self, key: Hashable, version: str, body: str,
+            headers: dict) -> None:
+        """ Caches body and headers for key at version, evicting the least
+        recently used entries to stay within max_size """
+        if len(body) > self.max_size:
+            return
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (version, body, headers)
+            self.size += len(body)
+            while self.size > self.max_size:
+                self._discard(next(iter(self._entries)))
+
+    def _discard(self, key: Hashable) -> None:
+        """ Removes the entry of key if there is one, lock held """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+
+RESPONSE_CACHE_BYTES = int(getenv('RESPONSE_CACHE_BYTES', str(64 * 2 ** 20)))
+response_cache = ResponseCache(RESPONSE_CACHE_BYTES)
+
+
+def versioned_response(
+        version: str,
+        build: Callable[[], Union[str, Tuple[str, dict]]]) -> Response:
+    """
+    Returns the JSON response of the current request, whose body (or
+    body and extra headers) build() returns. It must only depend on the
+    request and version.
+
+    The body is cached by path with query string, along with version,
+    and the version is the strong ETag of the response: a request whose
+    If-None-Match has it gets a 304 without a body. A None version
+    disables both, the body is built every time.
+    """
+    key = request.full_path
+    entry = response_cache.get(key, version) if version is not None \
+        else None
+    if entry is None:
+        entry = build()
+        if type(entry) is str:
+            entry = (entry, {})
+        if version is not None:
+            response_cache.put(key, version, *entry)
+    response = Response(entry[0], mimetype='application/json')
+    response.headers.extend(entry[1])
+    if version is None:
+        return response
+    response.set_etag(version)
+    return response.make_conditional(request)
@@ -2,7 +2,9 @@
 """ Module of Index views
 """
 from flask import jsonify, abort
+from api.v1.response_cache import versioned_response
 from api.v1.views import app_views
+from models.serializer import dumps
 
 
 @app_views.route('/status', methods=['GET'], strict_slashes=False)
@@ -19,11 +21,16 @@ def stats() -> str:
     """ GET /api/v1/stats
     Return:
       - the number of each objects
+      - 304 if If-None-Match has the ETag of the stats
     """
     from models.user import User
-    stats = {}
-    stats['users'] = User.count()
-    return jsonify(stats)
+
+    def build() -> str:
+        """ Body of the stats """
+        stats = {}
+        stats['users'] = User.count()
+        return dumps(stats) + "\n"
+    return versioned_response(User.collection_version(), build)
 
 
 @app_views.route('/unauthorized', strict_slashes=False)
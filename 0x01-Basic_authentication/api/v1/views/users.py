@@ -2,18 +2,239 @@
 """ Module of Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from flask import (abort, jsonify, request, Response,
+                   stream_with_context)
+from api.v1.response_cache import versioned_response
+from datetime import datetime, timezone
+from models.engine.storage import Range
+from models import hashers
+from models.serializer import dumps, dumps_list
 from models.user import User
+import base64
+import binascii
+
+
+MAX_PAGE_SIZE = 1000
+# Most users POST and DELETE /api/v1/users/bulk handle at once
+MAX_BULK_SIZE = 1000
+# Query parameters of GET /api/v1/users filtering users by equality
+FILTERS = ('email', 'first_name', 'last_name')
+
+
+def encode_cursor(user_id: str) -> str:
+    """ Opaque pagination token pointing after user_id
+    """
+    return base64.urlsafe_b64encode(user_id.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> str:
+    """ User ID of a pagination token, None if the token is invalid:
+    any character outside of the alphabet, or a token that isn't the
+    one encode_cursor() gives, is rejected
+    """
+    try:
+        user_id = base64.b64decode(cursor.encode(), altchars=b'-_',
+                                   validate=True).decode()
+    except (binascii.Error, UnicodeError, ValueError):
+        return None
+    return user_id if encode_cursor(user_id) == cursor else None
+
+
+def json_response(text: str, status: int = 200) -> Response:
+    """ Response of an already encoded JSON text, as jsonify makes them
+    """
+    return Response(text + "\n", status=status, mimetype='application/json')
+
+
+def parse_fields(value: str) -> tuple:
+    """ Sorted fields of a `fields` query parameter ("id,email"), None
+    if one of them isn't a public User field
+    """
+    fields = tuple(sorted(set(field.strip() for field in value.split(','))))
+    public = User.public_fields()
+    if any(field not in public for field in fields):
+        return None
+    return fields
+
+
+def parse_filters(args: dict) -> dict:
+    """ Search attributes of the filtering query parameters, None if one
+    of them is invalid
+    """
+    filters = {name: args[name] for name in FILTERS if name in args}
+    created_after = args.get('created_after')
+    if created_after is not None:
+        try:
+            created_after = datetime.fromisoformat(created_after)
+        except ValueError:
+            return None
+        if created_after.tzinfo is not None:
+            created_after = created_after.astimezone(timezone.utc)\
+                .replace(tzinfo=None)
+        filters['created_at'] = Range(after=created_after)
+    return filters
+
+
+def users_text(users: list, fields: tuple = None) -> str:
+    """ Body of a list of User objects JSON represented, using their
+    cached JSON texts (or only their fields)
+    """
+    return dumps_list(user.to_json_text(fields=fields)
+                      for user in users) + "\n"
+
+
+def search_users(filters: dict, after: str = None) -> list:
+    """ Users matching filters ordered by ID, starting after the ID after
+    """
+    users = sorted(User.search(filters), key=lambda user: user.id)
+    if after is not None:
+        users = [user for user in users if user.id > after]
+    return users
+
+
+def stream_users(after: str = None, limit: int = None, fields: tuple = None,
+                 filters: dict = None):
+    """ Generator of User objects JSON represented, one per line, ordered
+    by ID, fetched MAX_PAGE_SIZE at a time (searched at once if filters)
+    """
+    if filters:
+        for user in search_users(filters, after)[:limit]:
+            yield user.to_json_text(fields=fields) + "\n"
+        return
+    while limit is None or limit > 0:
+        size = MAX_PAGE_SIZE if limit is None else min(limit, MAX_PAGE_SIZE)
+        users = User.page(size, after)
+        for user in users:
+            yield user.to_json_text(fields=fields) + "\n"
+        if len(users) < size:
+            return
+        after = users[-1].id
+        if limit is not None:
+            limit -= len(users)
 
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters (optional):
+      - limit: maximum number of users to return (up to 1000)
+      - cursor: token of the next page, from the X-Next-Cursor header
+      - format: `ndjson` to stream one User JSON per line
+      - fields: comma separated fields to return (e.g. `id,email`)
+      - email, first_name, last_name: only users with this value
+      - created_after: only users created after this ISO 8601 date
+    Return:
+      - list of all (matching) User objects JSON represented, ordered by
+        ID when limit, cursor or format is given
+      - X-Next-Cursor header if there are more users after this page
+      - 400 if limit, cursor, fields or created_after is invalid
+      - 304 if If-None-Match has the ETag of the users (not for ndjson)
+    """
+    limit = request.args.get('limit')
+    cursor = request.args.get('cursor')
+    ndjson = request.args.get('format') == 'ndjson'
+    fields = request.args.get('fields')
+    if fields is not None:
+        fields = parse_fields(fields)
+        if fields is None:
+            return jsonify({'error': "Invalid fields"}), 400
+    filters = parse_filters(request.args)
+    if filters is None:
+        return jsonify({'error': "Invalid created_after"}), 400
+
+    if limit is None and cursor is None and not ndjson:
+        return versioned_response(
+            User.collection_version(),
+            lambda: users_text(User.search(filters), fields))
+
+    after = None
+    if cursor is not None:
+        after = decode_cursor(cursor)
+        if after is None:
+            return jsonify({'error': "Invalid cursor"}), 400
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if limit <= 0 or limit > MAX_PAGE_SIZE:
+            return jsonify({'error': "Invalid limit"}), 400
+
+    if ndjson:
+        return Response(stream_with_context(
+            stream_users(after, limit, fields, filters)),
+            mimetype='application/x-ndjson')
+
+    def page() -> tuple:
+        """ Body and headers of the page """
+        size = limit or MAX_PAGE_SIZE
+        if filters:
+            users = search_users(filters, after)[:size]
+        else:
+            users = User.page(size, after)
+        headers = {}
+        if len(users) == size:
+            headers['X-Next-Cursor'] = encode_cursor(users[-1].id)
+        return users_text(users, fields), headers
+    return versioned_response(User.collection_version(), page)
+
+
+@app_views.route('/users/changes', methods=['GET'], strict_slashes=False)
+def view_user_changes() -> str:
+    """ GET /api/v1/users/changes
+    Query parameters (optional):
+      - since: `next` of the previous response; without it, no change
+        is returned, only the `next` to start from
+      - limit: maximum number of changes to read (up to 1000)
     Return:
-      - list of all User objects JSON represented
+      - changes: the users saved ({seq, op: put, id, user}) or removed
+        ({seq, op: delete, id}) after since, in order, only the last
+        change of each user
+      - next: since of the next request
+      - more: true if there are changes after next
+      - 410 if the changes after since aren't retained anymore, or
+        since comes from another process (or from before a restart):
+        the client has to pull GET /api/v1/users again, after taking
+        the `next` of the response to continue from
+      - 400 if since or limit is invalid
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    log = User.change_log()
+    since = request.args.get('since')
+    limit = request.args.get('limit', MAX_PAGE_SIZE)
+    try:
+        limit = int(limit)
+    except ValueError:
+        limit = 0
+    if limit <= 0 or limit > MAX_PAGE_SIZE:
+        return jsonify({'error': "Invalid limit"}), 400
+    if since is None:
+        return jsonify({'changes': [], 'more': False,
+                        'next': log.token(log.latest)})
+    try:
+        since = log.seq_of(since)
+    except ValueError:
+        return jsonify({'error': "Invalid since"}), 400
+    entries = log.since(since, limit) if since is not None else None
+    if entries is None:
+        return jsonify({'error': "Resync required",
+                        'next': log.token(log.latest)}), 410
+
+    last = {}
+    for entry in entries:
+        last.pop(entry[2], None)
+        last[entry[2]] = entry
+    changes = []
+    for seq, op, obj_id in last.values():
+        change = {'seq': seq, 'op': 'delete', 'id': obj_id}
+        user = User.get(obj_id) if op == 'put' else None
+        if user is not None:
+            change['op'] = 'put'
+            change['user'] = user.to_json()
+        changes.append(change)
+    next_seq = entries[-1][0] if len(entries) > 0 else since
+    return json_response(dumps({'changes': changes,
+                                'more': next_seq < log.latest,
+                                'next': log.token(next_seq)}))
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -21,16 +242,27 @@ def view_one_user(user_id: str = None) -> str:
     """ GET /api/v1/users/:id
     Path parameter:
       - User ID
+    Query parameter (optional):
+      - fields: comma separated fields to return (e.g. `id,email`)
     Return:
       - User object JSON represented
       - 404 if the User ID doesn't exist
+      - 400 if fields is invalid
+      - 304 if If-None-Match has the ETag of the User
     """
     if user_id is None:
         abort(404)
+    fields = request.args.get('fields')
+    if fields is not None:
+        fields = parse_fields(fields)
+        if fields is None:
+            return jsonify({'error': "Invalid fields"}), 400
     user = User.get(user_id)
     if user is None:
         abort(404)
-    return jsonify(user.to_json())
+    return versioned_response(
+        "{}-{}".format(user.id, user.version),
+        lambda: user.to_json_text(fields=fields) + "\n")
 
 
 @app_views.route('/users/<user_id>', methods=['DELETE'], strict_slashes=False)
@@ -83,12 +315,113 @@ def create_user() -> str:
             user.first_name = rj.get("first_name")
             user.last_name = rj.get("last_name")
             user.save()
-            return jsonify(user.to_json()), 201
+            return json_response(user.to_json_text(), 201)
         except Exception as e:
             error_msg = "Can't create User: {}".format(e)
     return jsonify({'error': error_msg}), 400
 
 
+@app_views.route('/users/bulk', methods=['POST'], strict_slashes=False)
+def create_users() -> str:
+    """ POST /api/v1/users/bulk
+    JSON body: list of users, each with
+      - email
+      - password
+      - last_name (optional)
+      - first_name (optional)
+    Return:
+      - created: list of User objects JSON represented
+      - errors: list of {index, error} for each user that can't be created
+      - 400 if the body isn't a list, or has more than MAX_BULK_SIZE users
+    Passwords are hashed concurrently (see hashers.submit_each) before
+    taking the write lock; users are persisted once, after all of them
+    are created
+    """
+    rj = request.get_json(silent=True)
+    if type(rj) is not list:
+        return jsonify({'error': "Wrong format"}), 400
+    if len(rj) > MAX_BULK_SIZE:
+        return jsonify({'error': "Too many users (at most {})".format(
+            MAX_BULK_SIZE)}), 400
+
+    errors = []
+    valid = []
+    for index, item in enumerate(rj):
+        error_msg = None
+        if type(item) is not dict:
+            error_msg = "Wrong format"
+        if error_msg is None and item.get("email", "") == "":
+            error_msg = "email missing"
+        if error_msg is None and item.get("password", "") == "":
+            error_msg = "password missing"
+        if error_msg is None:
+            valid.append((index, item))
+        else:
+            errors.append({'index': index, 'error': error_msg})
+
+    # As the password setter does, non string passwords are set to None
+    hashes = hashers.submit_each(
+        hashers.current_hasher(), 'hash',
+        ((item["password"],) for _, item in valid
+         if type(item["password"]) is str))
+    users = []
+    for index, item in valid:
+        try:
+            hashed = next(hashes) if type(item["password"]) is str \
+                else None
+            users.append((index, User(
+                email=item.get("email"),
+                _password=hashed.result() if hashed is not None else None,
+                first_name=item.get("first_name"),
+                last_name=item.get("last_name"))))
+        except Exception as e:
+            errors.append({'index': index,
+                           'error': "Can't create User: {}".format(e)})
+
+    created = []
+    with User.batch():
+        for index, user in users:
+            try:
+                user.save()
+                created.append(user.to_json())
+            except Exception as e:
+                errors.append({'index': index,
+                               'error': "Can't create User: {}".format(e)})
+    errors.sort(key=lambda error: error['index'])
+    status = 201 if len(created) > 0 else 400
+    return jsonify({'created': created, 'errors': errors}), status
+
+
+@app_views.route('/users/bulk', methods=['DELETE'], strict_slashes=False)
+def delete_users() -> str:
+    """ DELETE /api/v1/users/bulk
+    JSON body: list of User IDs
+    Return:
+      - deleted: list of deleted User IDs
+      - errors: list of {index, error} for each ID that can't be deleted
+      - 400 if the body isn't a list, or has more than MAX_BULK_SIZE IDs
+    Deletions are persisted once, after all of them are done
+    """
+    rj = request.get_json(silent=True)
+    if type(rj) is not list:
+        return jsonify({'error': "Wrong format"}), 400
+    if len(rj) > MAX_BULK_SIZE:
+        return jsonify({'error': "Too many users (at most {})".format(
+            MAX_BULK_SIZE)}), 400
+
+    deleted = []
+    errors = []
+    with User.batch():
+        for index, user_id in enumerate(rj):
+            user = User.get(user_id) if type(user_id) is str else None
+            if user is None:
+                errors.append({'index': index, 'error': "Not found"})
+                continue
+            user.remove()
+            deleted.append(user_id)
+    return jsonify({'deleted': deleted, 'errors': errors}), 200
+
+
 @app_views.route('/users/<user_id>', methods=['PUT'], strict_slashes=False)
 def update_user(user_id: str = None) -> str:
     """ PUT /api/v1/users/:id
@@ -119,4 +452,4 @@ def update_user(user_id: str = None) -> str:
     if rj.get('last_name') is not None:
         user.last_name = rj.get('last_name')
     user.save()
-    return jsonify(user.to_json()), 200
+    return json_response(user.to_json_text())
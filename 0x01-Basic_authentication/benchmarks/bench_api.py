@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+""" Load test of the API with BasicAuth: seeds N users, then drives the
+app with a mix of authenticated GET/POST/PUT/DELETE requests, through
+the Flask test client and through a local WSGI server
+
+Usage: python3 -m benchmarks.bench_api [--users 1000,100000,1000000]
+           [--transports client,server] [--seconds 10] [--threads 4]
+           [--mix get=70,list=5,post=10,put=10,delete=5] [--output FILE]
+
+Each (users, transport) run happens in a new process working in a new
+empty directory, with the storage selected by the usual environment
+variables (STORAGE_ENGINE, STORAGE_MODE, ...). Results are printed as
+a table and, with --output, appended to FILE as one JSON object per
+line.
+"""
+import argparse
+import base64
+import hashlib
+import http.client
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List
+
+
+EMAIL = "bench@example.com"
+PASSWORD = "bench password"
+# Statuses counted as successes, per operation: concurrent deletions
+# make some targets disappear
+EXPECTED = {
+    'get': (200, 404),
+    'list': (200,),
+    'post': (201,),
+    'put': (200, 404),
+    'delete': (200, 404),
+}
+
+
+def seed(count: int) -> float:
+    """ Create the benchmark user and count other users, persisted once;
+    return the seconds it took
+    """
+    from models.user import User
+
+    start = time.perf_counter()
+    password = hashlib.sha256(PASSWORD.encode()).hexdigest()
+    with User.batch():
+        user = User(email=EMAIL)
+        user.password = PASSWORD
+        user.save()
+        for i in range(count):
+            User(email="user{}@example.com".format(i), _password=password,
+                 first_name="First{}".format(i)).save()
+    return time.perf_counter() - start
+
+
+def client_session() -> Callable:
+    """ Return a function sending requests through a Flask test client
+    """
+    from api.v1.app import app
+
+    client = app.test_client()
+
+    def send(method: str, path: str, headers: dict, body: dict) -> tuple:
+        response = client.open(path, method=method, headers=headers,
+                               json=body)
+        return response.status_code, response.get_data()
+    return send
+
+
+def server_session(port: int) -> Callable:
+    """ Return a function sending requests on a keep-alive HTTP connection
+    to the local server on port
+    """
+    connection = [None]
+
+    def send(method: str, path: str, headers: dict, body: dict) -> tuple:
+        data = None
+        headers = dict(headers)
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        for attempt in range(2):
+            if connection[0] is None:
+                connection[0] = http.client.HTTPConnection('127.0.0.1', port)
+            try:
+                connection[0].request(method, path, data, headers)
+                response = connection[0].getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, OSError):
+                connection[0].close()
+                connection[0] = None
+                if attempt == 1:
+                    raise
+    return send
+
+
+def percentiles(durations: List[float]) -> Dict[str, float]:
+    """ Return the p50/p95/p99 of durations (seconds) in milliseconds,
+    nearest-rank
+    """
+    if len(durations) == 0:
+        return {}
+    durations = sorted(durations)
+    result = {}
+    for p in (50, 95, 99):
+        rank = max(0, -(-p * len(durations) // 100) - 1)
+        result['p{}'.format(p)] = round(durations[rank] * 1000, 3)
+    return result
+
+
+def workload(make_session: Callable, seconds: float, threads: int,
+             mix: Dict[str, int]) -> dict:
+    """ Run threads clients sending the mix of requests for seconds and
+    return the throughput and latencies
+    """
+    headers = {'Authorization': "Basic " + base64.b64encode(
+        "{}:{}".format(EMAIL, PASSWORD).encode()).decode()}
+
+    send = make_session()
+    status, data = send('GET', '/api/v1/users?limit=1000', headers, None)
+    if status != 200:
+        raise RuntimeError("Can't list users: {}".format(status))
+    ids = [user['id'] for user in json.loads(data)
+           if user['email'] != EMAIL]
+
+    operations = list(mix)
+    weights = [mix[operation] for operation in operations]
+    results = []
+    deadline = time.monotonic() + seconds
+
+    def client(index: int):
+        rand = random.Random(index)
+        send = make_session()
+        created = []
+        durations = {operation: [] for operation in operations}
+        errors = 0
+        counter = 0
+        while time.monotonic() < deadline:
+            operation = rand.choices(operations, weights)[0]
+            if operation == 'delete' and len(created) == 0:
+                operation = 'get'
+            body = None
+            if operation == 'get':
+                method, path = 'GET', '/api/v1/users/' + rand.choice(ids)
+            elif operation == 'list':
+                method, path = 'GET', '/api/v1/users?limit=100'
+            elif operation == 'post':
+                counter += 1
+                method, path = 'POST', '/api/v1/users'
+                body = {'email': "load{}.{}.{}@example.com".format(
+                    os.getpid(), index, counter), 'password': PASSWORD}
+            elif operation == 'put':
+                method, path = 'PUT', '/api/v1/users/' + rand.choice(ids)
+                body = {'first_name': "Name{}".format(counter)}
+            else:
+                method, path = 'DELETE', '/api/v1/users/' + created.pop()
+            start = time.perf_counter()
+            status, data = send(method, path, headers, body)
+            durations[operation].append(time.perf_counter() - start)
+            if status not in EXPECTED[operation]:
+                errors += 1
+            elif operation == 'post':
+                created.append(json.loads(data)['id'])
+        results.append((durations, errors))
+
+    workers = [threading.Thread(target=client, args=(i,))
+               for i in range(threads)]
+    start = time.monotonic()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - start
+
+    merged = {operation: [] for operation in operations}
+    for durations, _ in results:
+        for operation, values in durations.items():
+            merged[operation].extend(values)
+    everything = [value for values in merged.values() for value in values]
+    latency = {operation: dict(percentiles(values), count=len(values))
+               for operation, values in merged.items()}
+    latency['all'] = percentiles(everything)
+    return {
+        'requests': len(everything),
+        'errors': sum(errors for _, errors in results),
+        'throughput': round(len(everything) / elapsed, 1),
+        'latency_ms': latency,
+    }
+
+
+def child(args: argparse.Namespace):
+    """ Seed the store, then run the workload (test client) or serve the
+    app (server), in the current process
+    """
+    from api.v1.app import app
+
+    seed_seconds = seed(args.users)
+    if args.transports == 'client':
+        result = workload(client_session, args.seconds, args.threads,
+                          parse_mix(args.mix))
+        result['seed_seconds'] = round(seed_seconds, 3)
+        print(json.dumps(result))
+        return
+
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    print(json.dumps({'port': server.server_port,
+                      'seed_seconds': round(seed_seconds, 3)}), flush=True)
+    server.serve_forever()
+
+
+def run(users: int, transport: str, args: argparse.Namespace) -> dict:
+    """ Run one benchmark in a new process and directory
+    """
+    env = dict(os.environ, AUTH_TYPE='basic_auth', BENCH_CHILD='1',
+               PYTHONPATH=os.getcwd())
+    env.setdefault('PASSWORD_SCHEME', 'sha256')
+    command = [sys.executable, '-m', 'benchmarks.bench_api',
+               '--users', str(users), '--transports', transport,
+               '--seconds', str(args.seconds), '--threads',
+               str(args.threads), '--mix', args.mix]
+    config = {
+        'users': users, 'transport': transport, 'threads': args.threads,
+        'seconds': args.seconds, 'mix': parse_mix(args.mix),
+        'engine': env.get('STORAGE_ENGINE', 'file'),
+        'storage_mode': env.get('STORAGE_MODE', 'file'),
+        'password_scheme': env['PASSWORD_SCHEME'],
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        if transport == 'client':
+            output = subprocess.run(command, env=env, cwd=tmp, check=True,
+                                    capture_output=True, text=True).stdout
+            return dict(config, **json.loads(output))
+
+        server = subprocess.Popen(command, env=env, cwd=tmp, text=True,
+                                  stdout=subprocess.PIPE)
+        try:
+            started = json.loads(server.stdout.readline())
+            result = workload(lambda: server_session(started['port']),
+                              args.seconds, args.threads,
+                              parse_mix(args.mix))
+        finally:
+            server.terminate()
+            server.wait()
+        result['seed_seconds'] = started['seed_seconds']
+        return dict(config, **result)
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    """ Parse "get=70,post=10,..." into {'get': 70, 'post': 10, ...}
+    """
+    result = {}
+    for item in mix.split(','):
+        operation, weight = item.split('=')
+        if operation not in EXPECTED:
+            raise ValueError("Unknown operation: {}".format(operation))
+        result[operation] = int(weight)
+    return result
+
+
+def main():
+    """ Run the benchmark for each user count and transport
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', default='1000,100000,1000000')
+    parser.add_argument('--transports', default='client,server')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--mix', default='get=70,list=5,post=10,put=10,'
+                                         'delete=5')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    if os.getenv('BENCH_CHILD'):
+        args.users = int(args.users)
+        child(args)
+        return
+
+    print("{:>8} {:>9} {:>10} {:>8} {:>9} {:>9} {:>9} {:>7}".format(
+        "users", "transport", "seed (s)", "req/s", "p50 (ms)", "p95 (ms)",
+        "p99 (ms)", "errors"))
+    for users in (int(count) for count in args.users.split(',')):
+        for transport in args.transports.split(','):
+            result = run(users, transport, args)
+            latency = result['latency_ms']['all']
+            print("{:>8} {:>9} {:>10} {:>8} {:>9} {:>9} {:>9} {:>7}".format(
+                users, transport, result['seed_seconds'],
+                result['throughput'], latency.get('p50'),
+                latency.get('p95'), latency.get('p99'), result['errors']),
+                flush=True)
+            if args.output:
+                with open(args.output, 'a') as f:
+                    f.write(json.dumps(result) + "\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+""" Requests per second of BasicAuth under floods of invalid
+Authorization headers, compared to valid ones
+
+A header given as a function gets the number of the request: 'unknown
+emails' sends a new email each time, so the rejected cache never helps
+
+Usage: python3 -m benchmarks.bench_auth_flood [seconds]
+"""
+import base64
+import os
+import subprocess
+import sys
+import time
+
+
+def basic(credentials: str) -> str:
+    """ Authorization header of credentials """
+    return "Basic " + base64.b64encode(credentials.encode()).decode()
+
+
+HEADERS = {
+    'no header': None,
+    'not basic': "Bearer abcdef",
+    'bad base64': "Basic %%%%not-base64%%%%",
+    'not utf-8': "Basic " + base64.b64encode(b'\xff\xfe:\xff').decode(),
+    'too long': basic("a" * 20000 + "@example.com:x"),
+    'no colon': basic("bench@example.com"),
+    'unknown email': basic("nobody@example.com:password"),
+    'unknown emails': lambda i: basic("nobody{}@example.com:password"
+                                      .format(i)),
+    'bad password': basic("bench@example.com:wrong"),
+    'valid': basic("bench@example.com:bench password"),
+}
+
+
+def measure(seconds: float, header) -> float:
+    """ Return the requests per second served for header (or the headers
+    header(i) makes), one client
+    """
+    from api.v1.app import app
+    from models.user import User
+
+    user = User(email="bench@example.com")
+    user.password = "bench password"
+    user.save()
+    for i in range(1000):
+        User(email="user{}@example.com".format(i)).save()
+    headers = {} if header is None else {'Authorization': header}
+    count = 0
+    with app.test_client() as c:
+        deadline = time.monotonic() + seconds
+        start = time.monotonic()
+        while time.monotonic() < deadline:
+            if callable(header):
+                headers = {'Authorization': header(count)}
+            c.get('/api/v1/stats', headers=headers)
+            count += 1
+    return count / (time.monotonic() - start)
+
+
+def main():
+    """ Run measure() in one process per header
+    """
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    if os.getenv('BENCH_CHILD'):
+        print("{:.1f}".format(measure(seconds, HEADERS[sys.argv[2]])))
+        return
+
+    print("{:>14} {:>10}".format("header", "req/s"))
+    for name in HEADERS:
+        env = dict(os.environ, AUTH_TYPE='basic_auth',
+                   STORAGE_ENGINE='memory', BENCH_CHILD='1')
+        env.setdefault('PASSWORD_SCHEME', 'sha256')
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_auth_flood',
+             str(seconds), name], env=env, capture_output=True, text=True)
+        result = output.stdout.strip() if output.returncode == 0 \
+            else "error"
+        print("{:>14} {:>10}".format(name, result))
+    print("one client, {} users".format(1001))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+""" Same workload against every storage engine
+
+Usage: python3 -m benchmarks.bench_engines [count]
+"""
+import sys
+import time
+from models.user import User
+from benchmarks.engines import ENGINES, in_temporary_directory, using
+
+
+def workload(count: int, persistent: bool) -> dict:
+    """ Return the seconds taken by each step of the workload
+
+    Reloading is skipped for the memory engine, which would drop
+    every user instead
+    """
+    timings = {}
+
+    def step(name, function):
+        start = time.perf_counter()
+        function()
+        timings[name] = time.perf_counter() - start
+
+    users = [User(email="user{}@example.com".format(i))
+             for i in range(count)]
+
+    def insert():
+        with User.batch():
+            for user in users:
+                user.save()
+
+    def get():
+        for user in users:
+            User.get(user.id)
+
+    def search():
+        for user in users:
+            User.search({'email': user.email})
+
+    def page():
+        after, pages = None, User.page(100)
+        while pages:
+            after = pages[-1].id
+            pages = User.page(100, after)
+
+    def update():
+        for user in users:
+            user.first_name = "Bob"
+            user.save()
+
+    def reload():
+        User.load_from_file()
+        User.count()
+
+    def delete():
+        with User.batch():
+            for user in users:
+                user.remove()
+
+    step('insert', insert)
+    step('get', get)
+    step('search', search)
+    step('page', page)
+    step('update', update)
+    if persistent:
+        step('reload', reload)
+    step('delete', delete)
+    return timings
+
+
+def main():
+    """ Run the workload on each engine in a fresh directory
+    """
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    steps = ('insert', 'get', 'search', 'page', 'update', 'reload',
+             'delete')
+    print(("{:>8}" + " {:>10}" * len(steps)).format("engine", *steps))
+    for name, engine in ENGINES.items():
+        with in_temporary_directory(), using(engine()):
+            User.load_from_file()
+            timings = workload(count, name != 'memory')
+        print(("{:>8}" + " {:>10}" * len(steps)).format(name, *(
+            "{:.0f}".format(count / timings[s]) if s in timings else "-"
+            for s in steps)))
+    print("operations per second, {} users".format(count))
+
+
+if __name__ == '__main__':
+    main()
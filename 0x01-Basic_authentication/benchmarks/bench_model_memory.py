@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+""" Memory benchmark of User instances per MODEL_LAYOUT
+
+Usage: python3 -m benchmarks.bench_model_memory [count]
+"""
+import os
+import subprocess
+import sys
+import tracemalloc
+
+
+def measure(count: int) -> float:
+    """ Return the bytes allocated per User for count users kept by id
+    """
+    from models.user import User
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    users = {}
+    for i in range(count):
+        user = User(email="user{}@example.com".format(i),
+                    created_at="2024-11-23T11:14:23",
+                    updated_at="2024-11-23T11:14:23")
+        user._password = "{:064x}".format(i)
+        users[user.id] = user
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / count
+
+
+def main():
+    """ Run measure() in one process per layout and print the results
+    """
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    if os.getenv('BENCH_CHILD'):
+        print("{:.1f}".format(measure(count)))
+        return
+
+    print("{:>8} {:>10} {:>14}".format("layout", "users", "bytes/user"))
+    for layout in ('dict', 'slots'):
+        env = dict(os.environ, MODEL_LAYOUT=layout, BENCH_CHILD='1')
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_model_memory',
+             str(count)], env=env, check=True, capture_output=True,
+            text=True).stdout
+        print("{:>8} {:>10} {:>14}".format(layout, count, output.strip()))
+
+
+if __name__ == '__main__':
+    main()
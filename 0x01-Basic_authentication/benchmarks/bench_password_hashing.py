@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+""" Authenticated requests per second for each password scheme, with and
+without the verified-credential cache of BasicAuth
+
+Usage: python3 -m benchmarks.bench_password_hashing [seconds] [threads]
+"""
+import base64
+import os
+import subprocess
+import sys
+import threading
+import time
+
+
+def measure(seconds: float, threads: int) -> float:
+    """ Return the authenticated requests per second served to threads
+    clients sending the same credentials for seconds, after one request
+    that fills the cache when it's enabled
+    """
+    from api.v1.app import app
+    from models.user import User
+
+    user = User(email="bench@example.com")
+    user.password = "bench password"
+    user.save()
+    header = "Basic " + base64.b64encode(
+        b"bench@example.com:bench password").decode()
+    with app.test_client() as c:
+        c.get('/api/v1/stats', headers={'Authorization': header})
+    counts = []
+    deadline = time.monotonic() + seconds
+
+    def client():
+        count = 0
+        with app.test_client() as c:
+            while time.monotonic() < deadline:
+                response = c.get('/api/v1/stats',
+                                 headers={'Authorization': header})
+                assert response.status_code == 200, response.status_code
+                count += 1
+        counts.append(count)
+
+    workers = [threading.Thread(target=client) for _ in range(threads)]
+    start = time.monotonic()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return sum(counts) / (time.monotonic() - start)
+
+
+def main():
+    """ Run measure() in one process per scheme and cache setting
+    """
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    if os.getenv('BENCH_CHILD'):
+        print("{:.1f}".format(measure(seconds, threads)))
+        return
+
+    from models.hashers import HASHERS
+    print("{:>8} {:>14} {:>14}".format("scheme", "no cache", "cache"))
+    for scheme in ('sha256', 'bcrypt', 'argon2'):
+        if scheme not in HASHERS:
+            print("{:>8} {:>14}".format(scheme, "not installed"))
+            continue
+        results = []
+        for cache_size in ('0', '1024'):
+            env = dict(os.environ, AUTH_TYPE='basic_auth',
+                       STORAGE_ENGINE='memory', PASSWORD_SCHEME=scheme,
+                       BASIC_AUTH_CACHE_SIZE=cache_size, BENCH_CHILD='1')
+            results.append(subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_password_hashing',
+                 str(seconds), str(threads)], env=env, check=True,
+                capture_output=True, text=True).stdout.strip())
+        print("{:>8} {:>14} {:>14}".format(scheme, *results))
+    print("requests per second, {} client threads".format(threads))
+
+
+if __name__ == '__main__':
+    main()
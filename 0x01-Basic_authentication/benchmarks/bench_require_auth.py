@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+""" Micro-benchmark of excluded paths matching
+
+Usage: python3 -m benchmarks.bench_require_auth
+"""
+import re
+import timeit
+from typing import List
+from api.v1.auth.auth import Auth, PathMatcher
+
+
+def legacy_require_auth(path: str, excluded_paths: List[str]) -> bool:
+    """ Per-call regex building, as Auth.require_auth used to do """
+    if excluded_paths is None or len(excluded_paths) == 0 or\
+            path is None or len(path) == 0:
+        return True
+
+    for excluded_path in excluded_paths:
+        if excluded_path.endswith('*'):
+            path_pattern = rf"{excluded_path[:-1]}.*"
+        else:
+            if not path.endswith('/'):
+                path += '/'
+            if not excluded_path.endswith('/'):
+                excluded_path += '/'
+            path_pattern = rf"{excluded_path}"
+        if re.match(path_pattern, path):
+            return False
+
+    return True
+
+
+def excluded_paths_of(size: int) -> List[str]:
+    """ Returns size excluded paths, mixing exact and wildcard entries """
+    paths = ['/api/v1/status/', '/api/v1/unauthorized/', '/api/v1/forbidden/']
+    for i in range(size - len(paths)):
+        if i % 2:
+            paths.append('/api/v1/public/{}/*'.format(i))
+        else:
+            paths.append('/api/v1/static/{}'.format(i))
+    return paths[:size]
+
+
+def main(number: int = 20000) -> None:
+    """ Prints the per-call cost of each implementation """
+    auth = Auth()
+    path = '/api/v1/users'
+    print("{:>8} {:>12} {:>12} {:>12}".format(
+        "patterns", "legacy (us)", "require_auth", "matcher"))
+    for size in (3, 500):
+        excluded_paths = excluded_paths_of(size)
+        matcher = PathMatcher(excluded_paths)
+        n = number if size < 100 else number // 20
+        results = [
+            timeit.timeit(lambda: legacy_require_auth(path, excluded_paths),
+                          number=n),
+            timeit.timeit(lambda: auth.require_auth(path, excluded_paths),
+                          number=n),
+            timeit.timeit(lambda: matcher.matches(path), number=n),
+        ]
+        print("{:>8} {:>12.2f} {:>12.2f} {:>12.2f}".format(
+            size, *(r / n * 1e6 for r in results)))
+
+
+if __name__ == '__main__':
+    main()
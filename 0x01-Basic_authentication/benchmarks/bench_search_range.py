@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+""" Benchmark of time-window queries: "users updated in the last hour"
+through the ordered index (search_range) against a scan and sort
+
+Usage: python3 -m benchmarks.bench_search_range [users ...]
+"""
+import sys
+import timeit
+from datetime import datetime, timedelta
+from models.engine.storage import Storage
+from models.user import User
+from benchmarks.engines import ENGINES, in_temporary_directory, using
+
+
+def seed(engine: Storage, count: int, now: datetime):
+    """ Store count users, one updated every second until now (put
+    directly: save() would set updated_at to the current time)
+    """
+    with User.batch():
+        for i in range(count):
+            updated_at = now - timedelta(seconds=count - i)
+            engine.put(User(email="user{}@example.com".format(i),
+                            updated_at=updated_at.isoformat()))
+
+
+def main():
+    """ Print the cost of one window query for each engine and size """
+    sizes = [int(size) for size in sys.argv[1:]] or [10000, 100000]
+    now = datetime(2024, 1, 1)
+    print("{:>7} {:>8} {:>8} {:>12} {:>12}".format(
+        "engine", "users", "found", "scan (ms)", "index (ms)"))
+    for name in ('memory', 'sqlite'):
+        for size in sizes:
+            with in_temporary_directory(), using(ENGINES[name]()) as engine:
+                User.load_from_file()
+                seed(engine, size, now)
+                start, end = now - timedelta(hours=1), now
+                found = len(User.search_range('updated_at', start, end))
+                number = 5
+                results = [
+                    timeit.timeit(lambda: Storage.search_range(
+                        engine, User, 'updated_at', start, end),
+                        number=number) / number,
+                    timeit.timeit(lambda: User.search_range(
+                        'updated_at', start, end), number=number) / number,
+                ]
+                print("{:>7} {:>8} {:>8} {:>12.2f} {:>12.2f}".format(
+                    name, size, found, *(r * 1000 for r in results)),
+                    flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+""" Serialization benchmark of User objects: the previous path
+(strftime + stdlib encoder, on every call) against the cached JSON
+texts, per JSON_BACKEND
+
+Usage: python3 -m benchmarks.bench_serialization [count]
+"""
+from datetime import datetime
+import gc
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+REPEAT = 3
+
+
+def legacy_to_json(obj, for_serialization: bool = False) -> dict:
+    """ Base.to_json before JSON texts were cached
+    """
+    result = {}
+    for key, value in obj.__dict__.items():
+        if key[0] == '_' and (not for_serialization or key == '_serialized'):
+            continue
+        if type(value) is datetime:
+            result[key] = value.strftime("%Y-%m-%dT%H:%M:%S")
+        else:
+            result[key] = value
+    return result
+
+
+def measure(count: int) -> dict:
+    """ Return the best of REPEAT seconds taken to serialize count users
+    as a response and as a file, before and after
+    """
+    from models.serializer import dumps
+    from models.user import User
+
+    users = []
+    for i in range(count):
+        user = User(email="user{}@example.com".format(i),
+                    first_name="Bob", last_name="Dylan")
+        user._password = "{:064x}".format(i)
+        users.append(user)
+
+    def response():
+        return "[" + ",".join(u.to_json_text() for u in users) + "]"
+
+    def file():
+        return "{" + ",".join(dumps(u.id) + ":" + u.to_json_text(True)
+                              for u in users) + "}"
+
+    def reset():
+        for user in users:
+            object.__setattr__(user, '_serialized', None)
+
+    def timed(function, setup=None) -> float:
+        best = None
+        for _ in range(REPEAT):
+            if setup is not None:
+                setup()
+            gc.collect()
+            gc.disable()
+            try:
+                start = time.perf_counter()
+                function()
+                elapsed = time.perf_counter() - start
+            finally:
+                gc.enable()
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    timings = {}
+    timings['response before'] = timed(lambda: json.dumps(
+        [legacy_to_json(u) for u in users], separators=(',', ':'),
+        sort_keys=True))
+    timings['file before'] = timed(lambda: json.dumps(
+        {u.id: legacy_to_json(u, True) for u in users}))
+    timings['response cold'] = timed(response, reset)
+    timings['file cold'] = timed(file, reset)
+    timings['response warm'] = timed(response)
+    timings['file warm'] = timed(file)
+    return timings
+
+
+def main():
+    """ Run measure() in one process per JSON_BACKEND and print the
+    results
+    """
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    if os.getenv('BENCH_CHILD'):
+        print(json.dumps(measure(count)))
+        return
+
+    steps = None
+    for backend in ('json', 'auto'):
+        env = dict(os.environ, JSON_BACKEND=backend, MODEL_LAYOUT='dict',
+                   BENCH_CHILD='1')
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_serialization',
+             str(count)], env=env, check=True, capture_output=True,
+            text=True).stdout
+        timings = json.loads(output)
+        if steps is None:
+            steps = list(timings)
+            print(("{:>8}" + " {:>15}" * len(steps)).format(
+                "backend", *steps))
+        print(("{:>8}" + " {:>15.3f}" * len(steps)).format(
+            backend, *(timings[step] for step in steps)))
+    print("seconds for {} users; 'before' is the previous path, 'cold' "
+          "fills the caches, 'warm' reuses them".format(count))
+
+
+if __name__ == '__main__':
+    main()
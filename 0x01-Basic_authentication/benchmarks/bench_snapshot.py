@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+""" Benchmark of loading the users from a JSON snapshot against a binary
+one, eagerly and lazily: startup time, first lookups and memory
+
+Usage: python3 -m benchmarks.bench_snapshot [users ...]
+
+For each number of users, both snapshots of the same users are written
+in a new directory, then each (format, load mode) is measured in a new
+process.
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def seed(count: int):
+    """ Write .db_User.json (and its offset index) and .db_User.bin with
+    count users
+    """
+    from models.binary_store import write_snapshot
+    from models.lazy_store import scan, write_index
+    from models.serializer import dumps
+    from models.user import User
+
+    password = "{:064x}".format(0)
+    users = [User(email="user{}@example.com".format(i), _password=password,
+                  first_name="First{}".format(i), last_name="Last")
+             for i in range(count)]
+    with open('.db_User.json', 'w') as f:
+        f.write("{" + ",".join(dumps(user.id) + ":" + user.to_json_text(True)
+                               for user in users) + "}")
+    with open('.db_User.json', 'rb') as f:
+        write_index('.db_User.json', scan(f.read()))
+    with open('.db_User.bin', 'wb') as f:
+        write_snapshot(f, ((user.id, user.to_json(True)) for user in users),
+                       User.FIELDS, indexed=User.index_names() +
+                       tuple(User.ORDERED_INDEXES))
+    with open('ids.json', 'w') as f:
+        json.dump([users[i].id for i in range(0, count, count // 100 or 1)],
+                  f)
+
+
+def resident_kb() -> int:
+    """ Return the current resident memory of the process in KiB """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') \
+                // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def child() -> dict:
+    """ Load the users with the environment configuration and return
+    the timings and memory
+    """
+    from models.user import User
+
+    with open('ids.json') as f:
+        ids = json.load(f)
+    before = resident_kb()
+    start = time.perf_counter()
+    User.load_from_file()
+    load = time.perf_counter() - start
+    loaded = resident_kb()
+
+    start = time.perf_counter()
+    for obj_id in ids:
+        User.get(obj_id)
+    gets = (time.perf_counter() - start) / len(ids)
+    start = time.perf_counter()
+    User.search({'email': "user1@example.com"})
+    search = time.perf_counter() - start
+    return {
+        'load_s': round(load, 3),
+        'get_us': round(gets * 1e6, 1),
+        'first_search_s': round(search, 3),
+        'rss_after_load_mb': round((loaded - before) / 1024, 1),
+        'rss_after_search_mb': round((resident_kb() - before) / 1024, 1),
+    }
+
+
+def main():
+    """ Measure every (format, load mode) for each number of users """
+    if os.getenv('BENCH_CHILD'):
+        print(json.dumps(child()))
+        return
+    sizes = [int(size) for size in sys.argv[1:]] or [100000, 1000000]
+    print("{:>8} {:>7} {:>6} {:>10} {:>9} {:>8} {:>11} {:>9} {:>10}".format(
+        "users", "format", "load", "file (MB)", "load (s)", "get (us)",
+        "search (s)", "RSS (MB)", "+search"))
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, PYTHONPATH=os.getcwd())
+            subprocess.run([sys.executable, '-c',
+                            'from benchmarks.bench_snapshot import seed; '
+                            'seed({})'.format(size)],
+                           env=env, cwd=tmp, check=True)
+            for snapshot_format, extension in (('json', 'json'),
+                                               ('binary', 'bin')):
+                file_mb = os.path.getsize(os.path.join(
+                    tmp, '.db_User.' + extension)) / 2 ** 20
+                for load_mode in ('eager', 'lazy'):
+                    output = subprocess.run(
+                        [sys.executable, '-m', 'benchmarks.bench_snapshot'],
+                        env=dict(env, BENCH_CHILD='1', STORAGE_ENGINE='file',
+                                 SNAPSHOT_FORMAT=snapshot_format,
+                                 LOAD_MODE=load_mode),
+                        cwd=tmp, check=True, capture_output=True,
+                        text=True).stdout
+                    result = json.loads(output)
+                    print("{:>8} {:>7} {:>6} {:>10.1f} {:>9} {:>8} {:>11} "
+                          "{:>9} {:>10}".format(
+                              size, snapshot_format, load_mode, file_mb,
+                              result['load_s'], result['get_us'],
+                              result['first_search_s'],
+                              result['rss_after_load_mb'],
+                              result['rss_after_search_mb']), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+""" Conformance checks every storage engine must pass
+
+Usage: python3 -m benchmarks.engine_conformance [engine ...]
+"""
+import os
+import sys
+import traceback
+from datetime import datetime
+import models.base
+from models.base import Base, MODEL_LAYOUT
+from models.engine import file_storage
+from models.engine.db_storage import DBStorage
+from models.engine.storage import Range
+from benchmarks.engines import ENGINES, in_temporary_directory, using
+
+
+class Member(Base):
+    """ Model exercising every kind of index
+    """
+    UNIQUE_INDEXES = ('email',)
+    INDEXES = ('group',)
+    FIELDS = Base.FIELDS + ('email', 'group', 'name')
+    if MODEL_LAYOUT == 'slots':
+        __slots__ = FIELDS[len(Base.FIELDS):]
+
+    def __init__(self, *args: list, **kwargs: dict):
+        """ Initialize a Member instance
+        """
+        super().__init__(*args, **kwargs)
+        self.email = kwargs.get('email')
+        self.group = kwargs.get('group')
+        self.name = kwargs.get('name')
+
+
+def new_members(count: int, group: str = 'a') -> list:
+    """ Save and return count new members
+    """
+    members = []
+    for i in range(count):
+        member = Member(email="{}{}@io".format(group, i), group=group,
+                        name="n{}".format(i))
+        member.save()
+        members.append(member)
+    return members
+
+
+def check_empty(persistent: bool):
+    """ A fresh store has no object """
+    assert Member.count() == 0
+    assert Member.all() == []
+    assert Member.get("nope") is None
+
+
+def check_save_get(persistent: bool):
+    """ Saved objects can be read back by id """
+    members = new_members(3)
+    assert Member.count() == 3
+    member = Member.get(members[1].id)
+    assert member == members[1]
+    assert member.to_json() == members[1].to_json()
+
+
+def check_search(persistent: bool):
+    """ Search works on unique, indexed and plain attributes """
+    new_members(4, 'a')
+    new_members(2, 'b')
+    assert len(Member.search()) == 6
+    assert [m.name for m in Member.search({'email': 'a2@io'})] == ['n2']
+    assert len(Member.search({'group': 'b'})) == 2
+    assert len(Member.search({'name': 'n1'})) == 2
+    assert len(Member.search({'group': 'b', 'name': 'n1'})) == 1
+    assert Member.search({'email': 'zz@io'}) == []
+
+
+def check_search_range(persistent: bool):
+    """ Search matches Range conditions, alone or with equalities """
+    members = new_members(4, 'a') + new_members(2, 'b')
+    for i, member in enumerate(members):
+        member.created_at = datetime(2020, 1, 1 + i)
+        member.save()
+    after = Range(after=datetime(2020, 1, 2))
+    assert len(Member.search({'created_at': after})) == 4
+    assert len(Member.search({'created_at': Range(
+        after=datetime(2020, 1, 2), before=datetime(2020, 1, 5))})) == 2
+    assert len(Member.search({'created_at': after, 'group': 'b'})) == 2
+    assert len(Member.search({'created_at': after, 'name': 'n1',
+                              'group': 'b'})) == 1
+    assert Member.search({'name': Range(after='n3')}) == []
+
+
+def check_ordered(persistent: bool):
+    """ search_range() is ordered and follows saves and removals """
+    members = new_members(5)
+    for i, member in enumerate(members):
+        member.created_at = datetime(2020, 1, 5 - i)
+        member.save()
+    names = ['n4', 'n3', 'n2', 'n1', 'n0']
+    assert [m.name for m in Member.search_range('created_at')] == names
+    assert [m.name for m in Member.search_range(
+        'created_at', datetime(2020, 1, 2), datetime(2020, 1, 4))] == \
+        ['n3', 'n2']
+    assert [m.name for m in Member.search_range(
+        'created_at', datetime(2020, 1, 2), limit=2)] == ['n3', 'n2']
+    members[4].remove()
+    members[0].created_at = datetime(2019, 1, 1)
+    members[0].save()
+    assert [m.name for m in Member.search_range('created_at')] == \
+        ['n0', 'n3', 'n2', 'n1']
+    updated = [m.updated_at for m in Member.search_range('updated_at')]
+    assert len(updated) == 4 and updated == sorted(updated)
+    assert [m.name for m in Member.search_range('name', 'n1', 'n3')] == \
+        ['n1', 'n2']
+
+
+def check_update(persistent: bool):
+    """ Updated attributes are searchable by their new value only """
+    member = new_members(1)[0]
+    member = Member.get(member.id)
+    member.email = "new@io"
+    member.group = "c"
+    member.save()
+    assert Member.search({'email': 'a0@io'}) == []
+    assert [m.id for m in Member.search({'email': 'new@io'})] == [member.id]
+    assert [m.id for m in Member.search({'group': 'c'})] == [member.id]
+    assert Member.count() == 1
+
+
+def check_unique(persistent: bool):
+    """ Saving a duplicate of a unique attribute raises ValueError """
+    new_members(1)
+    try:
+        Member(email="a0@io").save()
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("duplicate email saved")
+    assert Member.count() == 1
+
+
+def check_remove(persistent: bool):
+    """ Removed objects are gone, removing twice is harmless """
+    members = new_members(3)
+    latest = Member.change_log().latest
+    members[0].remove()
+    members[0].remove()
+    Member(email="new@io").remove()
+    assert [op for _, op, _ in Member.change_log().since(latest)] == \
+        ['delete']
+    assert Member.count() == 2
+    assert Member.get(members[0].id) is None
+    assert Member.search({'email': 'a0@io'}) == []
+
+
+def check_versions(persistent: bool):
+    """ Saves are numbered after the stored object, not the instance """
+    member = new_members(1)[0]
+    assert member.version == 1
+    first, second = (Member(**Member.get(member.id).to_json(True))
+                     for _ in range(2))
+    before = Member.collection_version()
+    first.name = "first"
+    first.save()
+    second.name = "second"
+    second.save()
+    assert (first.version, second.version) == (2, 3)
+    assert Member.get(member.id).version == 3
+    assert Member.collection_version() != before
+    if isinstance(models.base.storage, DBStorage):
+        other = DBStorage(models.base.storage.db_path)
+        assert other.version(Member) == Member.collection_version()
+
+
+def check_page(persistent: bool):
+    """ Pages are ordered by id and start after the given id """
+    ids = sorted(m.id for m in new_members(7))
+    assert [m.id for m in Member.page(3)] == ids[:3]
+    assert [m.id for m in Member.page(3, ids[2])] == ids[3:6]
+    assert [m.id for m in Member.page(10, ids[5])] == ids[6:]
+    assert Member.page(3, ids[-1]) == []
+
+
+def check_batch(persistent: bool):
+    """ Writes of a batch are all applied """
+    with Member.batch():
+        members = new_members(5)
+        members[0].remove()
+    assert Member.count() == 4
+
+
+def check_reload(persistent: bool):
+    """ Persistent engines give back the same objects after a reload """
+    if not persistent:
+        return
+    members = new_members(3)
+    members[0].remove()
+    members[1].name = "renamed"
+    members[1].save()
+    Member.load_from_file()
+    assert Member.count() == 2
+    assert Member.get(members[1].id).name == "renamed"
+    assert Member.get(members[1].id).to_json() == members[1].to_json()
+    assert [m.id for m in Member.search({'email': 'a2@io'})] == \
+        [members[2].id]
+    assert [m.id for m in Member.search_range('created_at')] == \
+        [m.id for m in sorted(Member.all(),
+                              key=lambda m: (m.created_at, m.id))]
+
+
+def check_lazy_writes(persistent: bool):
+    """ Writes don't build the lazily loaded objects they don't touch """
+    if not isinstance(models.base.storage, file_storage.FileStorage) or \
+            file_storage.LOAD_MODE != 'lazy':
+        return
+    ids = [m.id for m in new_members(5)]
+    models.base.storage.compact(Member)
+    Member.load_from_file()
+    member = Member.get(ids[0])
+    member.name = "renamed"
+    member.save()
+    models.base.storage.compact(Member)
+    objs = models.base.storage._objects(Member)
+    assert [objs.built(obj_id) is None for obj_id in ids] == \
+        [False] + [True] * 4
+    Member.load_from_file()
+    assert Member.count() == 5
+    assert Member.get(ids[0]).name == "renamed"
+    assert Member.get(ids[1]).name == "n1"
+
+
+def check_offset_index(persistent: bool):
+    """ Lazily loaded JSON files are read through their offset index,
+    rebuilt when it's missing or stale
+    """
+    if not isinstance(models.base.storage, file_storage.FileStorage) or \
+            file_storage.LOAD_MODE != 'lazy' or \
+            file_storage.SNAPSHOT_FORMAT != 'json':
+        return
+    names = ['a}b', '{"c": 1}', 'quote \\" }', 'caf\u00e9 }{']
+    members = new_members(len(names))
+    for member, name in zip(members, names):
+        member.name = name
+        member.save()
+    models.base.storage.compact(Member)
+    expected = sorted((m.id, m.name) for m in members)
+    for damage in (None, b"", b"JIDX stale"):
+        if damage is not None:
+            with open('.db_Member.idx', 'wb') as f:
+                f.write(damage)
+        Member.load_from_file()
+        assert sorted((m.id, m.name) for m in Member.all()) == expected
+    assert os.path.getsize('.db_Member.idx') > len(b"JIDX stale")
+
+
+def check_snapshot_indexes(persistent: bool):
+    """ The indexes of a lazily loaded binary snapshot find what a scan
+    finds, through updates, removals and additions
+    """
+    if not isinstance(models.base.storage, file_storage.FileStorage) or \
+            file_storage.LOAD_MODE != 'lazy' or \
+            file_storage.SNAPSHOT_FORMAT != 'binary':
+        return
+    members = new_members(6, 'a') + new_members(4, 'b')
+    for i, member in enumerate(members):
+        member.created_at = datetime(2020, 1, 10 - i % 5)
+        if i % 4 == 0:
+            member.group = None
+        member.save()
+    models.base.storage.compact(Member)
+    Member.load_from_file()
+    assert models.base.storage._stored_indexes(Member) is not None
+    assert len(Member.search({'email': 'b1@io'})) == 1
+    objs = models.base.storage._objects(Member)
+    assert sum(objs.built(m.id) is not None for m in members) == 1
+
+    def ids(objs: list) -> list:
+        return [m.id for m in objs]
+
+    def expect():
+        everyone = sorted(Member.all(), key=lambda m: m.id)
+        for email in ('a0@io', 'b1@io', 'new@io', 'zz@io'):
+            assert ids(Member.search({'email': email})) == \
+                [m.id for m in everyone if m.email == email]
+        for group in ('a', 'b', None):
+            assert sorted(ids(Member.search({'group': group}))) == \
+                [m.id for m in everyone if m.group == group]
+        by_date = sorted(everyone, key=lambda m: (m.created_at, m.id))
+        start, end = datetime(2020, 1, 7), datetime(2020, 1, 9)
+        assert ids(Member.search_range('created_at')) == ids(by_date)
+        assert ids(Member.search_range('created_at', start, end)) == \
+            [m.id for m in by_date if start <= m.created_at < end]
+        assert ids(Member.search_range('created_at', start, limit=3)) == \
+            [m.id for m in by_date if start <= m.created_at][:3]
+        assert sorted(ids(Member.search({'created_at': Range(
+            after=start)}))) == [m.id for m in everyone
+                                 if m.created_at > start]
+        assert ids(Member.page(3, everyone[2].id)) == ids(everyone[3:6])
+        assert ids(Member.page(100)) == ids(everyone)
+
+    expect()
+    member = Member.get(members[0].id)
+    member.email = "new@io"
+    member.created_at = datetime(2019, 1, 1)
+    member.save()
+    Member.get(members[1].id).remove()
+    Member(email="c0@io", group="b").save()
+    Member.get(members[2].id).group = 'b'
+    expect()
+    for email, member_id in (('b1@io', None), ('new@io', members[3].id)):
+        try:
+            if member_id is None:
+                Member(email=email).save()
+            else:
+                Member.get(member_id).email = email
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("duplicate email saved")
+
+
+def check_torn_log(persistent: bool):
+    """ A record torn by a crash hides no record of the log """
+    if not isinstance(models.base.storage, file_storage.FileStorage) or \
+            file_storage.STORAGE_MODE != 'log':
+        return
+    new_members(3, 'a')
+    with open('.db_Member.log', 'a') as f:
+        f.write('{"op": "put", "id": "torn')
+    new_members(3, 'b')
+    with open('.db_Member.log', 'a') as f:
+        f.write('{"op": "put", "id": "torn')
+    Member.load_from_file()
+    assert Member.count() == 6
+    new_members(2, 'c')
+    Member.load_from_file()
+    assert Member.count() == 8
+
+
+CHECKS = [check_empty, check_save_get, check_search, check_search_range,
+          check_ordered, check_update, check_unique, check_remove,
+          check_versions, check_page, check_batch, check_reload,
+          check_lazy_writes, check_offset_index, check_snapshot_indexes,
+          check_torn_log]
+
+
+def main():
+    """ Run every check against every engine, each in a fresh directory
+    """
+    names = sys.argv[1:] or list(ENGINES)
+    failures = 0
+    for name in names:
+        for check in CHECKS:
+            with in_temporary_directory(), using(ENGINES[name]()):
+                try:
+                    Member.load_from_file()
+                    check(name != 'memory')
+                    result = "ok"
+                except Exception:
+                    failures += 1
+                    result = "FAIL\n" + traceback.format_exc()
+            print("{:<8} {:<16} {}".format(name, check.__name__, result))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
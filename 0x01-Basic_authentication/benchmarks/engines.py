@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+""" Storage engines used by the conformance checks and the benchmark
+"""
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Callable, Dict
+import models.base
+from models.engine.db_storage import DBStorage
+from models.engine.file_storage import FileStorage
+from models.engine.memory_storage import MemoryStorage
+from models.engine.storage import Storage
+
+
+ENGINES: Dict[str, Callable[[], Storage]] = {
+    'memory': MemoryStorage,
+    'file': FileStorage,
+    'sqlite': DBStorage,
+}
+
+
+@contextmanager
+def using(engine: Storage):
+    """ Make the models use engine for the duration of the block
+    """
+    previous = models.base.storage
+    models.base.storage = engine
+    try:
+        yield engine
+    finally:
+        models.base.storage = previous
+
+
+@contextmanager
+def in_temporary_directory():
+    """ Run the block in a new empty working directory
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            yield tmp
+        finally:
+            os.chdir(cwd)
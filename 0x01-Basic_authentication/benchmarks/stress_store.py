@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+""" Stress test of concurrent User create/update/delete/read
+
+Runs the operations through the Flask app from many threads while
+another thread keeps parsing .db_User.json, then checks reloading the
+store from disk gives back the in-memory one.
+
+Usage: python3 -m benchmarks.stress_store [threads] [operations]
+Run it from an empty directory with PYTHONPATH pointing to the project:
+it writes .db_User.json in the current directory.
+"""
+import json
+import random
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def worker(client, operations: int, errors: list):
+    """ Run a random mix of operations on the users endpoints
+    """
+    my_ids = []
+    for i in range(operations):
+        op = random.random()
+        if op < 0.4 or len(my_ids) == 0:
+            r = client.post('/api/v1/users', json={
+                'email': "{}-{}@stress.io".format(threading.get_ident(), i),
+                'password': "pwd"})
+            if r.status_code != 201:
+                errors.append("POST {}".format(r.status_code))
+            else:
+                my_ids.append(r.get_json()['id'])
+        elif op < 0.6:
+            r = client.put('/api/v1/users/{}'.format(random.choice(my_ids)),
+                           json={'first_name': str(i)})
+            if r.status_code != 200:
+                errors.append("PUT {}".format(r.status_code))
+        elif op < 0.75:
+            user_id = my_ids.pop(random.randrange(len(my_ids)))
+            r = client.delete('/api/v1/users/{}'.format(user_id))
+            if r.status_code != 200:
+                errors.append("DELETE {}".format(r.status_code))
+        else:
+            r = client.get('/api/v1/users')
+            if r.status_code != 200:
+                errors.append("GET {}".format(r.status_code))
+
+
+def reader(stop: threading.Event, errors: list) -> int:
+    """ Parse the file until stop is set, return the number of reads
+    """
+    reads = 0
+    while not stop.is_set():
+        try:
+            with open('.db_User.json') as f:
+                json.load(f)
+            reads += 1
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            errors.append("invalid file: {}".format(e))
+    return reads
+
+
+def main():
+    """ Run the stress test and print a report
+    """
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    operations = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    from api.v1.app import app
+    from models.base import STORAGE_ENGINE
+    from models.user import User
+    User.load_from_file()
+    errors = []
+    stop = threading.Event()
+    with ThreadPoolExecutor(threads + 1) as pool:
+        file_reads = pool.submit(reader, stop, errors)
+        futures = [pool.submit(worker, app.test_client(), operations, errors)
+                   for _ in range(threads)]
+        for future in futures:
+            future.result()
+        stop.set()
+        reads = file_reads.result()
+
+    if STORAGE_ENGINE != 'memory':
+        in_memory = set(user.id for user in User.all())
+        User.load_from_file()
+        if set(user.id for user in User.all()) != in_memory:
+            errors.append("reloaded store doesn't match the in-memory one")
+
+    print("{} threads x {} operations, {} file reads, {} errors".format(
+        threads, operations, reads, len(errors)))
+    for error in errors[:10]:
+        print(" ", error)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,38 +2,116 @@
 """ Base module
 """
 from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
-import json
+from typing import TypeVar, List, Iterable, Tuple
+from os import getenv
 import uuid
+from models.change_log import ChangeLog
+from models.serializer import TIMESTAMP_FORMAT, dumps, format_timestamp
 
 
-TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
-DATA = {}
+# 'dict': attributes in __dict__, 'slots': only FIELDS, stored in __slots__
+MODEL_LAYOUT = getenv('MODEL_LAYOUT', 'dict')
+
+# 'file' (default): in memory, persisted in .db_<Class>.json files
+# 'memory': in memory only
+# 'sqlite': in a SQLite database
+STORAGE_ENGINE = getenv('STORAGE_ENGINE', 'file')
+if STORAGE_ENGINE == 'memory':
+    from models.engine.memory_storage import MemoryStorage
+    storage = MemoryStorage()
+elif STORAGE_ENGINE == 'sqlite':
+    from models.engine.db_storage import DBStorage
+    storage = DBStorage()
+else:
+    from models.engine.file_storage import FileStorage
+    storage = FileStorage()
+
+
+# Attributes set through the storage engine, by class
+_INDEXED_ATTRIBUTES = {}
+# Changes made by this process, by class
+_CHANGE_LOGS = {}
+
+
+def _indexed_attributes(cls: type) -> frozenset:
+    """ Return the attributes of cls listed in one of its indexes
+    """
+    indexed = _INDEXED_ATTRIBUTES.get(cls)
+    if indexed is None:
+        indexed = frozenset(cls.index_names() + tuple(cls.ORDERED_INDEXES))
+        _INDEXED_ATTRIBUTES[cls] = indexed
+    return indexed
 
 
 class Base():
     """ Base class
+
+    Objects are kept by the storage engine selected by STORAGE_ENGINE.
+
+    Subclasses can declare secondary indexes on attributes that are often
+    searched by equality: `UNIQUE_INDEXES` rejects two saved objects sharing
+    the same value, `INDEXES` allows it. Indexed values must be hashable.
+    `ORDERED_INDEXES` keep objects sorted by an attribute (None values
+    are left out), e.g. to paginate by id or to find the objects of a
+    time window with `search_range()`. `TIMESTAMPS` are the attributes
+    holding datetimes.
+
+    `FIELDS` lists the persisted attributes; with MODEL_LAYOUT=slots they
+    are the only attributes an instance can have.
+
+    `version` counts the saves of an object (it's persisted): the storage
+    engine numbers each save after the stored object, so two instances of
+    it saved in turn get different versions. The `collection_version()`
+    of a class changes whenever one of its objects is saved or removed:
+    they identify states worth caching. Saves and
+    removals are also recorded in the `change_log()` of the class.
+
+    The persisted JSON text of an object is cached in `_serialized`
+    until one of its attributes is set; the other JSON forms are built
+    on demand. Projections on some `public_fields()` only format the
+    requested ones.
     """
+    INDEXES: Tuple[str, ...] = ()
+    UNIQUE_INDEXES: Tuple[str, ...] = ()
+    ORDERED_INDEXES: Tuple[str, ...] = ('id', 'created_at', 'updated_at')
+    TIMESTAMPS: Tuple[str, ...] = ('created_at', 'updated_at')
+    FIELDS: Tuple[str, ...] = ('id', 'created_at', 'updated_at', '_version')
+    if MODEL_LAYOUT == 'slots':
+        __slots__ = FIELDS + ('_serialized',)
 
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
-        """
-        s_class = str(self.__class__.__name__)
-        if DATA.get(s_class) is None:
-            DATA[s_class] = {}
 
-        self.id = kwargs.get('id', str(uuid.uuid4()))
+        A new instance isn't stored yet: its indexed attributes are set
+        directly, not through the storage engine
+        """
+        set_field = object.__setattr__
+        set_field(self, '_serialized', None)
+        set_field(self, 'id', kwargs.get('id', str(uuid.uuid4())))
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            set_field(self, 'created_at',
+                      datetime.fromisoformat(kwargs.get('created_at')))
         else:
-            self.created_at = datetime.utcnow()
+            set_field(self, 'created_at', datetime.utcnow())
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            set_field(self, 'updated_at',
+                      datetime.fromisoformat(kwargs.get('updated_at')))
         else:
-            self.updated_at = datetime.utcnow()
+            set_field(self, 'updated_at', datetime.utcnow())
+        set_field(self, '_version', kwargs.get('_version') or 0)
+
+    def __setattr__(self, name: str, value) -> None:
+        """ Set an attribute, through the storage engine if it's indexed,
+        and drop the cached JSON text
+
+        The cache is dropped after the value is set, so a concurrent
+        to_json_text() can't cache a text older than the new value
+        """
+        if name not in _indexed_attributes(self.__class__):
+            super().__setattr__(name, value)
+        else:
+            storage.set_attribute(self, name, value)
+        super().__setattr__('_serialized', None)
 
     def __eq__(self, other: TypeVar('Base')) -> bool:
         """ Equality
@@ -44,69 +122,138 @@ class Base():
             return False
         return (self.id == other.id)
 
+    def _json_dict(self, for_serialization: bool) -> dict:
+        """ Build the JSON dictionary of the object
+        """
+        if hasattr(self, '__dict__'):
+            result = self.__dict__.copy()
+            result.pop('_serialized', None)
+        else:
+            result = {key: getattr(self, key, None) for key in self.FIELDS}
+        for key, value in result.items():
+            if type(value) is datetime:
+                result[key] = format_timestamp(value)
+        if not for_serialization:
+            for key in [key for key in result if key[0] == '_']:
+                del result[key]
+        return result
+
     def to_json(self, for_serialization: bool = False) -> dict:
         """ Convert the object a JSON dictionary
         """
+        return self._json_dict(for_serialization)
+
+    def _projection(self, fields: Iterable[str]) -> dict:
+        """ Build the JSON dictionary of the fields of the object
+        """
         result = {}
-        for key, value in self.__dict__.items():
-            if not for_serialization and key[0] == '_':
-                continue
+        for key in fields:
+            value = getattr(self, key, None)
             if type(value) is datetime:
-                result[key] = value.strftime(TIMESTAMP_FORMAT)
-            else:
-                result[key] = value
+                value = format_timestamp(value)
+            result[key] = value
         return result
 
+    def to_json_text(self, for_serialization: bool = False,
+                     fields: Tuple[str, ...] = None) -> str:
+        """ Convert the object to JSON text, as flask.jsonify would; only
+        its fields if given. The persisted text is cached
+
+        The cache is a list replaced when an attribute is set, so a text
+        built from older values only lands in a list already dropped
+        """
+        if fields is not None:
+            return dumps(self._projection(fields))
+        if not for_serialization:
+            return dumps(self._json_dict(False))
+        cache = self._serialized
+        if cache is None:
+            cache = []
+            super().__setattr__('_serialized', cache)
+        if len(cache) == 0:
+            cache.append(dumps(self._json_dict(True)))
+        return cache[0]
+
     @classmethod
-    def load_from_file(cls):
-        """ Load all objects from file
+    def public_fields(cls) -> Tuple[str, ...]:
+        """ Return the FIELDS of the JSON form, private ones left out
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
-            return
+        return tuple(field for field in cls.FIELDS if field[0] != '_')
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+    @classmethod
+    def load_from_file(cls):
+        """ Load all objects from the storage engine
+        """
+        storage.load(cls)
 
     @classmethod
     def save_to_file(cls):
-        """ Save all objects to file
+        """ Persist all objects with the storage engine
+        """
+        storage.flush(cls)
+
+    @classmethod
+    def batch(cls):
+        """ Context manager grouping writes of the block: the storage
+        engine may persist them at once on exit
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        return storage.batch(cls)
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @classmethod
+    def lock(cls):
+        """ Return the write lock of the class, a reentrant context manager
+        """
+        return storage.lock(cls)
+
+    @property
+    def version(self) -> int:
+        """ Number of times the object was saved
+        """
+        return self._version
 
     def save(self):
         """ Save current object
         """
-        s_class = self.__class__.__name__
-        self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        with storage.lock(self.__class__):
+            self.updated_at = datetime.utcnow()
+            storage.put(self)
+            self.change_log().append('put', self.id)
 
     def remove(self):
-        """ Remove object
+        """ Remove object, if it's stored
+        """
+        with storage.lock(self.__class__):
+            if storage.delete(self):
+                self.change_log().append('delete', self.id)
+
+    @classmethod
+    def index_names(cls) -> Tuple[str, ...]:
+        """ Return all indexed attribute names
+        """
+        return tuple(cls.UNIQUE_INDEXES) + tuple(cls.INDEXES)
+
+    @classmethod
+    def collection_version(cls) -> str:
+        """ Return a token that changes whenever an object of the class is
+        saved or removed, None if the storage engine can't tell
+        """
+        return storage.version(cls)
+
+    @classmethod
+    def change_log(cls) -> ChangeLog:
+        """ Return the log of the saves and removals of objects of the
+        class by this process
         """
-        s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        log = _CHANGE_LOGS.get(cls)
+        if log is None:
+            log = _CHANGE_LOGS.setdefault(cls, ChangeLog())
+        return log
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
-        s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        return storage.count(cls)
 
     @classmethod
     def all(cls) -> Iterable[TypeVar('Base')]:
@@ -114,24 +261,30 @@ class Base():
         """
         return cls.search()
 
+    @classmethod
+    def page(cls, limit: int, after: str = None) -> List[TypeVar('Base')]:
+        """ Return at most limit objects ordered by id, starting after
+        the id after
+        """
+        return storage.page(cls, limit, after)
+
+    @classmethod
+    def search_range(cls, attr: str, start=None, end=None,
+                     limit: int = None) -> List[TypeVar('Base')]:
+        """ Return at most limit objects whose attr is between start
+        (included) and end (excluded), ordered by attr then id; a None
+        bound isn't checked. Uses the ordered index of attr if it has one
+        """
+        return storage.search_range(cls, attr, start, end, limit)
+
     @classmethod
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
-        s_class = cls.__name__
-        return DATA[s_class].get(id)
+        return storage.get(cls, id)
 
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
         """
-        s_class = cls.__name__
-        def _search(obj):
-            if len(attributes) == 0:
-                return True
-            for k, v in attributes.items():
-                if getattr(obj, k) != v:
-                    return False
-            return True
-
-        return list(filter(_search, DATA[s_class].values()))
+        return storage.search(cls, attributes)
@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+""" BinaryStore module: binary snapshots of the objects of a class
+
+Usage (converter): python3 -m models.binary_store to-binary|to-json
+                       SOURCE DESTINATION
+
+A snapshot is, all integers little-endian:
+  - a fixed header (HEADER): magic, format version, number of fields,
+    of objects and of strings, offsets of the following sections
+  - a string table: the end offset of each string (unsigned 32 bits),
+    then the UTF-8 data of all strings, each distinct string once. The
+    first strings are the field names, 'id' first
+  - the records: one per object, sorted by id, each a reference per
+    field (unsigned 32 bits), so record i is at a fixed offset and the
+    records are the index by id, searched by bisection
+
+  - the indexes (since version 2, located by INDEXES after the header):
+    a directory of (field position, offset) then, for each indexed field
+    whose values are all strings or null, the positions of all records
+    (unsigned 32 bits) sorted by (value, id), null values first
+
+A reference is the index of a string, with JSON_FLAG set if the string
+is the JSON text of a value that isn't a string, or NULL, or MISSING if
+the object has no such attribute.
+"""
+from array import array
+from datetime import datetime
+from typing import BinaryIO, Iterable, Iterator, List, Tuple
+import mmap
+import struct
+import sys
+from models.record_store import RecordStore, array_bytes, array_view
+from models.serializer import dumps, format_timestamp, loads
+
+
+MAGIC = b'BSNP'
+FORMAT_VERSION = 2
+# magic, format version, fields, objects, strings, offset of the string
+# ends, offset of the string data, offset of the records
+HEADER = struct.Struct('<4sHHIIQQQ')
+# number of indexes, offset of their directory
+INDEXES = struct.Struct('<IQ')
+# field position, offset of the sorted record positions
+INDEX_ENTRY = struct.Struct('<IQ')
+MISSING = 0xFFFFFFFF
+NULL = 0xFFFFFFFE
+JSON_FLAG = 0x80000000
+
+
+def write_snapshot(f: BinaryIO, objs: Iterable[Tuple[str, object]],
+                   fields: Iterable[str] = (),
+                   source: 'SnapshotFile' = None,
+                   indexed: Iterable[str] = ()):
+    """ Write a snapshot of objs to the binary file f: (id, JSON
+    dictionary) pairs, or (id, position) pairs of records of the snapshot
+    source, copied without decoding their values
+
+    Fields are the given ones, then the fields of source, then the other
+    keys of the objects. The fields indexed (but 'id', the order of the
+    records) get an index if their values are all strings or null
+    """
+    records = sorted(objs, key=lambda item: item[0])
+    names = ['id'] + [name for name in fields if name != 'id']
+    known = set(names)
+    for name in source.fields if source is not None else ():
+        if name not in known:
+            names.append(name)
+            known.add(name)
+    for _, obj_json in records:
+        if type(obj_json) is int:
+            continue
+        for name in obj_json:
+            if name not in known:
+                names.append(name)
+                known.add(name)
+
+    refs = {}
+    data = []
+    ends = array('I')
+    size = 0
+
+    def ref(text: str) -> int:
+        nonlocal size
+        index = refs.get(text)
+        if index is None:
+            encoded = text.encode('utf-8')
+            size += len(encoded)
+            if len(refs) >= JSON_FLAG or size > 0xFFFFFFFF:
+                raise ValueError("Too much data for a snapshot")
+            index = len(refs)
+            refs[text] = index
+            data.append(encoded)
+            ends.append(size)
+        return index
+
+    # Index in the string table of source: index in the new one
+    copied = {}
+
+    def copy(reference: int) -> int:
+        if reference == MISSING or reference == NULL:
+            return reference
+        index = reference & ~JSON_FLAG
+        new_index = copied.get(index)
+        if new_index is None:
+            new_index = ref(source.string(index))
+            copied[index] = new_index
+        return new_index | (reference & JSON_FLAG)
+
+    for name in names:
+        ref(name)
+    if source is not None:
+        columns = [source.field_position(name) for name in names[1:]]
+    values = array('I')
+    for obj_id, obj_json in records:
+        values.append(ref(obj_id))
+        if type(obj_json) is int:
+            references = source.references(obj_json)
+            for column in columns:
+                values.append(MISSING if column < 0
+                              else copy(references[column]))
+            continue
+        for name in names[1:]:
+            if name not in obj_json:
+                values.append(MISSING)
+                continue
+            value = obj_json[name]
+            if type(value) is str:
+                values.append(ref(value))
+            elif value is None:
+                values.append(NULL)
+            else:
+                values.append(ref(dumps(value)) | JSON_FLAG)
+
+    # Sorted positions of the records, by field position
+    indexes = {}
+    strings = list(refs)
+    width = len(names)
+    for name in indexed:
+        column = names.index(name) if name in known else 0
+        if column == 0 or column in indexes:
+            continue
+        column_refs = values[column::width]
+        if any(JSON_FLAG <= reference < NULL for reference in column_refs):
+            continue
+        texts = ["" if reference >= NULL else strings[reference]
+                 for reference in column_refs]
+        nulls = [position for position, reference in enumerate(column_refs)
+                 if reference >= NULL]
+        indexes[column] = array('I', nulls + sorted(
+            (position for position, reference in enumerate(column_refs)
+             if reference < NULL), key=texts.__getitem__))
+
+    ends_offset = HEADER.size + INDEXES.size
+    data_offset = ends_offset + 4 * len(ends)
+    records_offset = data_offset + size
+    directory_offset = records_offset + 4 * len(values)
+    offset = directory_offset + INDEX_ENTRY.size * len(indexes)
+    f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(names), len(records),
+                        len(ends), ends_offset, data_offset,
+                        records_offset))
+    f.write(INDEXES.pack(len(indexes), directory_offset))
+    f.write(array_bytes(ends))
+    f.write(b"".join(data))
+    f.write(array_bytes(values))
+    for column in indexes:
+        f.write(INDEX_ENTRY.pack(column, offset))
+        offset += 4 * len(records)
+    for positions in indexes.values():
+        f.write(array_bytes(positions))
+
+
+def _stored(value):
+    """ Return a value as snapshots store it
+    """
+    if type(value) is datetime:
+        return format_timestamp(value)
+    return value
+
+
+class SnapshotFile():
+    """ Reader of a memory mapped snapshot
+
+    Opening it only reads the header: strings and records are read from
+    the mapping when they're asked for
+    """
+
+    def __init__(self, file_path: str):
+        """ Map the snapshot of file_path
+        """
+        with open(file_path, 'rb') as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._buffer) < HEADER.size:
+            raise ValueError("{} is not a snapshot".format(file_path))
+        (magic, version, field_count, self.count, string_count,
+         ends_offset, self._data_offset, records_offset) = \
+            HEADER.unpack_from(self._buffer)
+        if magic != MAGIC or not 1 <= version <= FORMAT_VERSION:
+            raise ValueError("{} is not a snapshot (version {})".format(
+                file_path, FORMAT_VERSION))
+        self._ends = array_view(self._buffer, ends_offset, string_count)
+        self._records = array_view(self._buffer, records_offset,
+                                   self.count * field_count)
+        self.fields = [self.string(i) for i in range(field_count)]
+        self._field_index = {field: i for i, field in enumerate(self.fields)}
+        self._width = field_count
+        # {field: (field position, sorted positions of the records)}
+        self._indexes = {}
+        if version >= 2:
+            index_count, directory_offset = INDEXES.unpack_from(
+                self._buffer, HEADER.size)
+            for i in range(index_count):
+                column, offset = INDEX_ENTRY.unpack_from(
+                    self._buffer, directory_offset + i * INDEX_ENTRY.size)
+                self._indexes[self.fields[column]] = (
+                    column, array_view(self._buffer, offset, self.count))
+
+    def string(self, index: int) -> str:
+        """ Return a string of the string table
+        """
+        start = self._data_offset
+        if index > 0:
+            start += self._ends[index - 1]
+        end = self._data_offset + self._ends[index]
+        return str(self._buffer[start:end], 'utf-8')
+
+    def id_at(self, position: int) -> str:
+        """ Return the id of the record at position
+        """
+        return self.string(self._records[position * self._width])
+
+    def lower_bound(self, obj_id: str) -> int:
+        """ Return the position of the first record whose id isn't lower
+        than obj_id, in O(log n)
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.id_at(middle) < obj_id:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(self, obj_id: str) -> int:
+        """ Return the position of the record of obj_id, -1 if there is
+        none, in O(log n)
+        """
+        position = self.lower_bound(obj_id)
+        if position < self.count and self.id_at(position) == obj_id:
+            return position
+        return -1
+
+    def has_index(self, field: str) -> bool:
+        """ Check if the snapshot has an index of field
+        """
+        return field in self._indexes
+
+    def index_entry(self, field: str, i: int) -> Tuple[str, int]:
+        """ Return the (value, record position) at i in the index of
+        field, the value None if it's null or missing
+        """
+        column, positions = self._indexes[field]
+        position = positions[i]
+        reference = self._records[position * self._width + column]
+        return (None if reference >= NULL else self.string(reference),
+                position)
+
+    def index_bisect(self, field: str, value: str,
+                     right: bool = False) -> int:
+        """ Return where value would be inserted in the index of field
+        (before the entries equal to it, or after them if right), in
+        O(log n); None is lower than any string
+        """
+        target = (0, "") if value is None else (1, value)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            text = self.index_entry(field, middle)[0]
+            key = (0, "") if text is None else (1, text)
+            if key < target or (right and key == target):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def field_position(self, field: str) -> int:
+        """ Return the position of field in the records, -1 if they don't
+        have it
+        """
+        return self._field_index.get(field, -1)
+
+    def references(self, position: int):
+        """ Return the references of the record at position, one per
+        field
+        """
+        start = position * self._width
+        return self._records[start:start + self._width]
+
+    def ids(self) -> List[str]:
+        """ Return the ids of all records, in order
+        """
+        width = self._width
+        return [self.string(self._records[i * width])
+                for i in range(self.count)]
+
+    def _value(self, reference: int):
+        """ Return the value a reference points to
+        """
+        if reference == NULL:
+            return None
+        if reference & JSON_FLAG:
+            return loads(self.string(reference & ~JSON_FLAG))
+        return self.string(reference)
+
+    def value(self, position: int, field: str):
+        """ Return one field of the record at position, None if it's
+        missing
+        """
+        index = self._field_index.get(field)
+        if index is None:
+            return None
+        reference = self._records[position * self._width + index]
+        return None if reference == MISSING else self._value(reference)
+
+    def records(self) -> Iterator[dict]:
+        """ Yield the JSON dictionary of every record, in order
+
+        The string table is decoded at once and its strings are shared by
+        the records, which is faster than record() when reading them all
+        """
+        ends = self._ends.tolist()
+        size = ends[-1] if len(ends) > 0 else 0
+        data = self._buffer[self._data_offset:self._data_offset + size]
+        if data.isascii():
+            text = data.decode('ascii')
+            strings = [text[start:end]
+                       for start, end in zip([0] + ends, ends)]
+        else:
+            strings = [str(data[start:end], 'utf-8')
+                       for start, end in zip([0] + ends, ends)]
+        del data
+        fields = self.fields
+        width = self._width
+        records = self._records
+        for start in range(0, self.count * width, width):
+            record = {}
+            for field, reference in zip(fields,
+                                        records[start:start + width]):
+                if reference < JSON_FLAG:
+                    record[field] = strings[reference]
+                elif reference == NULL:
+                    record[field] = None
+                elif reference != MISSING:
+                    record[field] = loads(strings[reference & ~JSON_FLAG])
+            yield record
+
+    def record(self, position: int) -> dict:
+        """ Return the JSON dictionary of the record at position
+        """
+        start = position * self._width
+        return {field: self._value(reference) for field, reference in zip(
+            self.fields, self._records[start:start + self._width])
+            if reference != MISSING}
+
+
+class BinaryStore(RecordStore):
+    """ Objects of one class, read from a binary snapshot on demand
+
+    Loading maps the snapshot and reads its header only: an object is
+    decoded and built the first time it's accessed (see RecordStore).
+
+    The indexes of the snapshot answer the lookups of the storage, but
+    for the objects touched since: objects whose indexed values may no
+    longer be the ones of their record, which the storage indexes itself
+    """
+
+    def __init__(self, cls: type, file_path: str):
+        """ Map the snapshot of file_path
+        """
+        super().__init__(cls, SnapshotFile(file_path))
+        self._touched = set()
+
+    def write(self, f: BinaryIO, fields: Iterable[str] = (),
+              indexed: Iterable[str] = ()):
+        """ Write a snapshot of all objects to the binary file f: the
+        records of objects that aren't built are copied from the mapped
+        snapshot, without building them
+        """
+        items = []
+        removed = self._removed
+        for position, obj_id in enumerate(self.file_ids()):
+            if obj_id not in removed:
+                obj = self._built.get(obj_id)
+                items.append((obj_id, position if obj is None
+                              else obj.to_json(True)))
+        for obj_id in list(self._added):
+            obj = self._built.get(obj_id)
+            if obj is not None:
+                items.append((obj_id, obj.to_json(True)))
+        write_snapshot(f, items, fields, self._file, indexed)
+
+    def has_indexes(self, attrs: Iterable[str]) -> bool:
+        """ Check if the snapshot indexes all of attrs ('id' is the order
+        of its records)
+        """
+        return all(attr == 'id' or self._file.has_index(attr)
+                   for attr in attrs)
+
+    def touch(self, obj_id: str) -> bool:
+        """ Leave an object out of the lookups of the snapshot indexes
+        from now on, return True if it wasn't yet
+        """
+        if obj_id in self._touched:
+            return False
+        self._touched.add(obj_id)
+        return True
+
+    def touched(self) -> List[str]:
+        """ Return the ids of the touched objects that exist
+        """
+        return [obj_id for obj_id in list(self._touched)
+                if obj_id in self._built]
+
+    def _skipped(self, obj_id: str) -> bool:
+        """ Check if the snapshot indexes must ignore an object
+        """
+        return obj_id in self._touched or obj_id in self._removed
+
+    def index_ids(self, attr: str, value) -> List[str]:
+        """ Return the ids of the untouched objects whose attr is value,
+        from the snapshot index of attr, in O(log n + k)
+        """
+        text = _stored(value)
+        if text is not None and type(text) is not str:
+            return []
+        i = self._file.index_bisect(attr, text)
+        end = self._file.index_bisect(attr, text, True)
+        ids = []
+        for i in range(i, end):
+            obj_id = self._file.id_at(self._file.index_entry(attr, i)[1])
+            if not self._skipped(obj_id):
+                ids.append(obj_id)
+        return ids
+
+    def index_keys(self, attr: str, start=None,
+                   end=None) -> Iterator[Tuple[object, str]]:
+        """ Yield the (value, id) of the untouched objects with start <=
+        attr < end, None values left out, sorted, from the snapshot index
+        of attr (or the records, for 'id'), in O(log n) then O(1) per key
+        """
+        snapshot = self._file
+        timestamp = attr in self._cls.TIMESTAMPS
+        if attr == 'id':
+            position = 0 if start is None else snapshot.lower_bound(start)
+            for position in range(position, snapshot.count):
+                obj_id = snapshot.id_at(position)
+                if end is not None and obj_id >= end:
+                    return
+                if not self._skipped(obj_id):
+                    yield obj_id, obj_id
+            return
+        # Stored values may be less precise: the bounds are checked again
+        i = snapshot.index_bisect(
+            attr, "" if start is None else _stored(start))
+        for i in range(i, snapshot.count):
+            text, position = snapshot.index_entry(attr, i)
+            value = datetime.fromisoformat(text) if timestamp else text
+            if end is not None and value >= end:
+                return
+            obj_id = snapshot.id_at(position)
+            if (start is None or value >= start) and \
+                    not self._skipped(obj_id):
+                yield value, obj_id
+
+
+def main():
+    """ Convert a .db_<Class>.json file to a binary snapshot, or back
+    """
+    if len(sys.argv) != 4 or sys.argv[1] not in ('to-binary', 'to-json'):
+        print(__doc__.split('\n\n')[1].strip(), file=sys.stderr)
+        sys.exit(2)
+    command, source, destination = sys.argv[1:]
+    if command == 'to-binary':
+        with open(source, 'rb') as f:
+            objs_json = loads(f.read())
+        with open(destination, 'wb') as f:
+            write_snapshot(f, objs_json.items())
+    else:
+        snapshot = SnapshotFile(source)
+        with open(destination, 'w') as f:
+            f.write("{" + ",".join(
+                dumps(snapshot.id_at(i)) + ":" + dumps(snapshot.record(i))
+                for i in range(snapshot.count)) + "}")
+
+
+if __name__ == '__main__':
+    main()
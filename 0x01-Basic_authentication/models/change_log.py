@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+""" Change log module
+"""
+from collections import deque
+from itertools import islice
+from os import getenv
+from typing import List, Tuple
+import os
+import threading
+
+
+# Number of changes kept per class, older ones require a resync
+CHANGE_LOG_SIZE = int(getenv('CHANGE_LOG_SIZE', '10000'))
+
+
+class ChangeLog():
+    """ Bounded in-memory log of the changes of one class
+
+    Each change is a (seq, op, id) tuple, op being 'put' or 'delete' (a
+    tombstone). Sequence numbers increase by one per change. Clients get
+    them as opaque tokens, "<epoch>.<seq>": the epoch is random, drawn
+    for each process and again on reset(), so a token of another
+    process, or from before a restart or a reload, is told apart and
+    the client is told to resync instead of missing changes.
+    """
+
+    def __init__(self, size: int = CHANGE_LOG_SIZE):
+        """ Initialize an empty log keeping the last size changes
+        """
+        self.size = size
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Forget every change and start a new epoch: the objects were
+        replaced wholesale (e.g. reloaded), previous tokens are stale
+        """
+        with self._lock:
+            self.epoch = os.urandom(8).hex()
+            self._entries.clear()
+            # Changes after _floor, up to _latest, are in _entries
+            self._floor = 0
+            self._latest = 0
+
+    @property
+    def latest(self) -> int:
+        """ Sequence number of the last change
+        """
+        return self._latest
+
+    def token(self, seq: int) -> str:
+        """ Return the token of a sequence number of this log
+        """
+        return "{}.{}".format(self.epoch, seq)
+
+    def seq_of(self, token: str) -> int:
+        """ Return the sequence number of a token, None if it's from
+        another epoch; raise ValueError if it isn't a token
+        """
+        epoch, _, seq = token.partition('.')
+        seq = int(seq)
+        if seq < 0:
+            raise ValueError("Invalid token: {}".format(token))
+        return seq if epoch == self.epoch else None
+
+    def append(self, op: str, obj_id: str) -> int:
+        """ Record a change and return its sequence number
+        """
+        with self._lock:
+            if self.size <= 0:
+                self._floor = self._latest = self._latest + 1
+                return self._latest
+            if len(self._entries) == self.size:
+                self._floor = self._entries[0][0]
+            self._latest += 1
+            self._entries.append((self._latest, op, obj_id))
+            return self._latest
+
+    def since(self, seq: int,
+              limit: int = None) -> List[Tuple[int, str, str]]:
+        """ Return the first limit changes after seq, in order, in
+        O(changes); None if some of them aren't retained anymore (or seq
+        is unknown)
+        """
+        with self._lock:
+            if seq < self._floor or seq > self._latest:
+                return None
+            newer = list(islice(reversed(self._entries), self._latest - seq))
+        newer.reverse()
+        return newer[:limit]
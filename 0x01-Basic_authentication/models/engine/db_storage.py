@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+""" DBStorage module
+"""
+from contextlib import contextmanager
+from datetime import datetime
+from os import getenv
+from typing import List, TypeVar
+import os
+import sqlite3
+import threading
+from models.engine.storage import Range, Storage, compile_predicate
+from models.serializer import format_timestamp
+
+
+# Path of the SQLite database
+SQLITE_PATH = getenv('SQLITE_PATH', '.db.sqlite3')
+# 'always': synchronous=FULL, 'never': synchronous=OFF
+DB_FSYNC = getenv('DB_FSYNC', 'always')
+
+
+class DBStorage(Storage):
+    """ Storage engine keeping objects in a SQLite database
+
+    One table per class, with a column per field of `FIELDS`, and a SQL
+    index per attribute of `INDEXES`, `UNIQUE_INDEXES` and
+    `ORDERED_INDEXES`. The database is in WAL mode, so several processes
+    can share it. Objects are built from rows on each read: attributes
+    outside of `FIELDS` aren't stored.
+
+    Versions are kept in the _versions table: a counter per class,
+    incremented in the transaction of each write, so every connection
+    of every process reads the same one, prefixed by an epoch drawn when
+    the table of the class is created.
+    """
+
+    def __init__(self, db_path: str = SQLITE_PATH):
+        """ Initialize the storage of the database at db_path
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._tables = set()
+
+    def _connection(self) -> sqlite3.Connection:
+        """ Return the connection of the current thread
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None,
+                                   check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous={}".format(
+                'FULL' if DB_FSYNC == 'always' else 'OFF'))
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    def lock(self, cls: type) -> threading.RLock:
+        """ Return the write lock of cls
+        """
+        s_class = cls.__name__
+        lock = self._locks.get(s_class)
+        if lock is None:
+            with self._locks_lock:
+                lock = self._locks.setdefault(s_class, threading.RLock())
+        return lock
+
+    @staticmethod
+    def _column(value):
+        """ Convert a value to its SQLite representation
+        """
+        if type(value) is datetime:
+            return format_timestamp(value)
+        return value
+
+    def _table(self, cls: type) -> str:
+        """ Create the table of cls and its indexes if needed, return its
+        quoted name
+        """
+        s_class = cls.__name__
+        table = '"{}"'.format(s_class)
+        if s_class in self._tables:
+            return table
+        columns = ['"id" TEXT PRIMARY KEY'] + \
+            ['"{}"'.format(field) for field in cls.FIELDS if field != 'id']
+        conn = self._connection()
+        conn.execute("CREATE TABLE IF NOT EXISTS {} ({})".format(
+            table, ", ".join(columns)))
+        existing = set(row['name'] for row in conn.execute(
+            "PRAGMA table_info({})".format(table)))
+        for field in cls.FIELDS:
+            if field not in existing:
+                conn.execute('ALTER TABLE {} ADD COLUMN "{}"'.format(
+                    table, field))
+        conn.execute('CREATE TABLE IF NOT EXISTS "_versions" ('
+                     '"class" TEXT PRIMARY KEY, "epoch" TEXT, "version" '
+                     'INTEGER)')
+        conn.execute('INSERT OR IGNORE INTO "_versions" VALUES (?, ?, 0)',
+                     (s_class, os.urandom(4).hex()))
+        for attr in cls.UNIQUE_INDEXES:
+            conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS "{0}_{1}" '
+                         'ON {2} ("{1}")'.format(s_class, attr, table))
+        for attr in tuple(cls.INDEXES) + tuple(cls.ORDERED_INDEXES):
+            if attr == 'id' or attr in cls.UNIQUE_INDEXES:
+                continue
+            conn.execute('CREATE INDEX IF NOT EXISTS "{0}_{1}" '
+                         'ON {2} ("{1}")'.format(s_class, attr, table))
+        self._tables.add(s_class)
+        return table
+
+    def _build(self, cls: type, row: sqlite3.Row) -> TypeVar('Base'):
+        """ Build an object from a row
+        """
+        return cls(**dict(row))
+
+    def version(self, cls: type) -> str:
+        """ Return a token of the state of all objects of cls, None inside
+        a batch: its writes may still be rolled back
+        """
+        self._table(cls)
+        conn = self._connection()
+        if self._local.depth > 0:
+            return None
+        row = conn.execute(
+            'SELECT "epoch", "version" FROM "_versions" WHERE "class" = ?',
+            (cls.__name__,)).fetchone()
+        return "{}-{}".format(*row)
+
+    def _bump(self, conn: sqlite3.Connection, cls: type):
+        """ Count a write of the objects of cls, in its transaction
+        """
+        conn.execute('UPDATE "_versions" SET "version" = "version" + 1 '
+                     'WHERE "class" = ?', (cls.__name__,))
+
+    @contextmanager
+    def _transaction(self) -> sqlite3.Connection:
+        """ Run the block in a transaction, or in the one of the current
+        batch
+        """
+        conn = self._connection()
+        if self._local.depth > 0:
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def load(self, cls: type):
+        """ Create the table of cls, objects stay in the database
+        """
+        self._table(cls)
+
+    def flush(self, cls: type):
+        """ Nothing to do: every write is committed
+        """
+        pass
+
+    def get(self, cls: type, obj_id: str) -> TypeVar('Base'):
+        """ Return one object by ID
+        """
+        row = self._connection().execute(
+            'SELECT * FROM {} WHERE "id" = ?'.format(self._table(cls)),
+            (obj_id,)).fetchone()
+        return None if row is None else self._build(cls, row)
+
+    def search(self, cls: type, attributes: dict) -> List[TypeVar('Base')]:
+        """ Search all objects with matching attributes
+
+        Attributes of FIELDS are matched in SQL, others on the built
+        objects
+        """
+        clauses = []
+        params = []
+        others = {}
+        for k, v in attributes.items():
+            if k not in cls.FIELDS:
+                others[k] = v
+            elif type(v) is not Range:
+                clauses.append('"{}" IS ?'.format(k))
+                params.append(self._column(v))
+            else:
+                clauses.append('"{}" IS NOT NULL'.format(k))
+                if v.after is not None:
+                    clauses.append('"{}" > ?'.format(k))
+                    params.append(self._column(v.after))
+                if v.before is not None:
+                    clauses.append('"{}" < ?'.format(k))
+                    params.append(self._column(v.before))
+        query = "SELECT * FROM {}".format(self._table(cls))
+        if len(clauses) > 0:
+            query += " WHERE " + " AND ".join(clauses)
+        objs = [self._build(cls, row)
+                for row in self._connection().execute(query, params)]
+        if len(others) == 0:
+            return objs
+        return list(filter(compile_predicate(others), objs))
+
+    def search_range(self, cls: type, attr: str, start=None, end=None,
+                     limit: int = None) -> List[TypeVar('Base')]:
+        """ Return at most limit objects with start <= attr < end, ordered
+        by attr then id, through the index of attr if it has one
+        """
+        if attr not in cls.FIELDS:
+            return super().search_range(cls, attr, start, end, limit)
+        clauses = ['"{}" IS NOT NULL'.format(attr)]
+        params = []
+        if start is not None:
+            clauses.append('"{}" >= ?'.format(attr))
+            params.append(self._column(start))
+        if end is not None:
+            clauses.append('"{}" < ?'.format(attr))
+            params.append(self._column(end))
+        params.append(-1 if limit is None else limit)
+        rows = self._connection().execute(
+            'SELECT * FROM {} WHERE {} ORDER BY "{}", "id" LIMIT ?'.format(
+                self._table(cls), " AND ".join(clauses), attr), params)
+        return [self._build(cls, row) for row in rows]
+
+    def count(self, cls: type) -> int:
+        """ Count all objects
+        """
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM {}".format(self._table(cls))).fetchone()[0]
+
+    def page(self, cls: type, limit: int,
+             after: str = None) -> List[TypeVar('Base')]:
+        """ Return at most limit objects ordered by id, starting after
+        the id after
+        """
+        rows = self._connection().execute(
+            'SELECT * FROM {} WHERE "id" > ? ORDER BY "id" LIMIT ?'.format(
+                self._table(cls)), ('' if after is None else after, limit))
+        return [self._build(cls, row) for row in rows]
+
+    def put(self, obj: TypeVar('Base')):
+        """ Insert or update an object, numbered after the stored row
+
+        An upsert on id, not INSERT OR REPLACE: that one would
+        silently delete the rows clashing on a unique column
+        """
+        cls = obj.__class__
+        table = self._table(cls)
+        values = [self._column(getattr(obj, field, None))
+                  for field in cls.FIELDS]
+        values[cls.FIELDS.index('_version')] = obj._version + 1
+        columns = ['"{}"'.format(field) for field in cls.FIELDS]
+        updates = ["{0} = excluded.{0}".format(column)
+                   for column in columns[1:] if column != '"_version"']
+        updates.append('"_version" = MAX(COALESCE({}."_version", 0) + 1, '
+                       'excluded."_version")'.format(table))
+        query = ("INSERT INTO {} ({}) VALUES ({}) "
+                 'ON CONFLICT("id") DO UPDATE SET {}').format(
+            table, ", ".join(columns), ", ".join("?" for _ in columns),
+            ", ".join(updates))
+        with self._transaction() as conn:
+            try:
+                conn.execute(query, values)
+            except sqlite3.IntegrityError as e:
+                raise ValueError(str(e))
+            self._bump(conn, cls)
+            obj._version = conn.execute(
+                'SELECT "_version" FROM {} WHERE "id" = ?'.format(table),
+                (obj.id,)).fetchone()[0]
+
+    def delete(self, obj: TypeVar('Base')) -> bool:
+        """ Remove an object, if it exists
+        """
+        cls = obj.__class__
+        table = self._table(cls)
+        with self._transaction() as conn:
+            row = conn.execute(
+                'SELECT "_version" FROM {} WHERE "id" = ?'.format(table),
+                (obj.id,)).fetchone()
+            if row is None:
+                return False
+            conn.execute('DELETE FROM {} WHERE "id" = ?'.format(table),
+                         (obj.id,))
+            self._bump(conn, cls)
+        obj._version = max(obj._version, row[0] or 0) + 1
+        return True
+
+    @contextmanager
+    def batch(self, cls: type):
+        """ Run the writes of the block in one transaction, committed on
+        exit, rolled back if the block raises
+        """
+        conn = self._connection()
+        with self.lock(cls):
+            self._local.depth += 1
+            if self._local.depth > 1:
+                try:
+                    yield
+                finally:
+                    self._local.depth -= 1
+                return
+
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            else:
+                conn.execute("COMMIT")
+            finally:
+                self._local.depth -= 1
@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+""" FileStorage module
+"""
+from contextlib import contextmanager
+from os import getenv, path
+from typing import List, TypeVar
+import fcntl
+import os
+import threading
+from models.binary_store import BinaryStore, SnapshotFile, write_snapshot
+from models.engine.memory_storage import MemoryStorage, locked
+from models.lazy_store import LazyStore, write_index
+from models.record_store import RecordStore
+from models.serializer import dumps, loads
+
+
+# 'file': every mutation rewrites .db_<Class>.json
+# 'log': every mutation appends one record to .db_<Class>.log, compacted
+#        into .db_<Class>.json after LOG_COMPACT_THRESHOLD records
+STORAGE_MODE = getenv('STORAGE_MODE', 'file')
+# 'always': fsync after each write, 'never': leave flushing to the OS
+DB_FSYNC = getenv('DB_FSYNC', 'always')
+LOG_COMPACT_THRESHOLD = int(getenv('LOG_COMPACT_THRESHOLD', '1000'))
+# 'eager': build every object at load, 'lazy': build objects on first access
+LOAD_MODE = getenv('LOAD_MODE', 'eager')
+# 'json': snapshots in .db_<Class>.json, 'binary': in .db_<Class>.bin,
+#         memory mapped (see models.binary_store)
+SNAPSHOT_FORMAT = getenv('SNAPSHOT_FORMAT', 'json')
+# '1': several processes share the files: writes hold an exclusive lock on
+#      .db_<Class>.lock and every operation first catches up with changes
+#      made by other processes
+DB_SHARED = getenv('DB_SHARED', '0') == '1'
+
+
+def snapshot_path(s_class: str) -> str:
+    """ Return the snapshot file of a class, in SNAPSHOT_FORMAT
+    """
+    if SNAPSHOT_FORMAT == 'binary':
+        return ".db_{}.bin".format(s_class)
+    return ".db_{}.json".format(s_class)
+
+
+def stat_key(file_path: str) -> tuple:
+    """ Return what identifies a version of a file, None if it's missing
+    """
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class StoreLock():
+    """ Write lock of a model class
+
+    A reentrant thread lock; with DB_SHARED, the outermost acquisition
+    also takes an exclusive lock on .db_<Class>.lock and catches up with
+    the changes of other processes, and the release records the state of
+    the files so this process doesn't reload its own writes. If catching
+    up fails, the state is forgotten instead, so the next acquisition
+    reloads everything.
+    """
+
+    def __init__(self, storage: 'FileStorage', cls: type):
+        """ Initialize the lock of cls
+        """
+        self._storage = storage
+        self._cls = cls
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self):
+        """ Acquire the lock
+        """
+        self._lock.acquire()
+        self._depth += 1
+        if self._depth == 1 and DB_SHARED:
+            try:
+                if self._file is None:
+                    self._file = open(
+                        ".db_{}.lock".format(self._cls.__name__), 'a')
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+                self._storage._sync(self._cls)
+            except BaseException:
+                self._storage._file_states.pop(self._cls.__name__, None)
+                self._release(False)
+                raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """ Release the lock
+        """
+        self._release(True)
+
+    def _release(self, synced: bool):
+        """ Release the lock, recording the state of the files if this
+        process is in sync with them
+        """
+        try:
+            if self._depth == 1 and DB_SHARED and self._file is not None:
+                try:
+                    if synced:
+                        self._storage._record_file_state(self._cls)
+                finally:
+                    fcntl.flock(self._file, fcntl.LOCK_UN)
+        finally:
+            self._depth -= 1
+            self._lock.release()
+
+
+class FileStorage(MemoryStorage):
+    """ Storage engine keeping objects in memory, persisted in
+    .db_<Class>.json files, or .db_<Class>.bin binary snapshots (and
+    .db_<Class>.log in log mode)
+    """
+
+    def __init__(self):
+        """ Initialize an empty storage
+        """
+        super().__init__()
+        self._log_files = {}
+        self._log_counts = {}
+        # {s_class: {'records': pending log records, 'dirty': bool}}
+        self._batches = {}
+        # {s_class: {'snapshot': stat key, 'log': stat key, 'offset': int}}
+        self._file_states = {}
+
+    def _new_lock(self, cls: type) -> StoreLock:
+        """ Create the write lock of cls
+        """
+        return StoreLock(self, cls)
+
+    @locked
+    def load(self, cls: type):
+        """ Load all objects from file, then replay the mutation log
+
+        With LOAD_MODE=lazy, objects of the file are only built on first
+        access (see LazyStore and BinaryStore)
+        """
+        s_class = cls.__name__
+        file_path = snapshot_path(s_class)
+        super().load(cls)
+        if path.exists(file_path) and SNAPSHOT_FORMAT == 'binary':
+            if LOAD_MODE == 'lazy':
+                self.objects[s_class] = BinaryStore(cls, file_path)
+            else:
+                objs = self.objects[s_class]
+                for obj_json in SnapshotFile(file_path).records():
+                    obj = cls(**obj_json)
+                    objs[obj.id] = obj
+        elif path.exists(file_path):
+            if LOAD_MODE == 'lazy':
+                self.objects[s_class] = LazyStore(cls, file_path)
+            else:
+                objs = self.objects[s_class]
+                with open(file_path, 'rb') as f:
+                    objs_json = loads(f.read())
+                    for obj_id, obj_json in objs_json.items():
+                        objs[obj_id] = cls(**obj_json)
+        self._replay_log(cls)
+        if DB_SHARED:
+            self._record_file_state(cls)
+
+    @locked
+    def flush(self, cls: type):
+        """ Save all objects to file
+
+        The file is written next to the destination then renamed over it,
+        so a crash never leaves a truncated file behind. Objects are
+        written with their cached JSON text, only the changed ones are
+        encoded again; objects of a LazyStore or a BinaryStore that
+        aren't built are copied from the file it maps. With
+        LOAD_MODE=lazy, the offset index of a JSON file is written too
+        """
+        s_class = cls.__name__
+        file_path = snapshot_path(s_class)
+        tmp_path = ".db_{}.{}.tmp".format(s_class, os.getpid())
+        if SNAPSHOT_FORMAT == 'binary':
+            objs = self._objects(cls)
+            with open(tmp_path, 'wb') as f:
+                indexed = cls.index_names() + tuple(cls.ORDERED_INDEXES)
+                if isinstance(objs, BinaryStore):
+                    objs.write(f, cls.FIELDS, indexed)
+                else:
+                    write_snapshot(f, ((obj.id, obj.to_json(True))
+                                       for obj in self._snapshot(cls)),
+                                   cls.FIELDS, indexed=indexed)
+                f.flush()
+                if DB_FSYNC == 'always':
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
+            return
+
+        objs = self._objects(cls)
+        if isinstance(objs, LazyStore):
+            items = objs.json_items()
+        else:
+            items = ((obj.id, obj.to_json_text(True))
+                     for obj in self._snapshot(cls))
+        chunks = [b"{"]
+        # The bounds of each record in the file, for its offset index
+        bounds = []
+        size = 1
+        for obj_id, text in items:
+            key = (("," if len(bounds) > 0 else "") + dumps(obj_id) +
+                   ":").encode('utf-8')
+            record = text.encode('utf-8')
+            start = size + len(key)
+            size = start + len(record)
+            bounds.append((obj_id, start, size))
+            chunks.append(key)
+            chunks.append(record)
+        chunks.append(b"}")
+        with open(tmp_path, 'wb') as f:
+            f.write(b"".join(chunks))
+            f.flush()
+            if DB_FSYNC == 'always':
+                os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+        if LOAD_MODE == 'lazy':
+            write_index(file_path, bounds)
+
+    def _replay_log(self, cls: type, offset: int = 0,
+                    changes: bool = False) -> int:
+        """ Apply the records of the mutation log, from offset, on top of
+        the objects and return the offset after the last applied record.
+        With changes, they're also recorded in the change log of cls (they
+        were made by other processes)
+
+        A record that can't be decoded is the trace of a crash during an
+        append: it's skipped, and if it ends the log it's truncated so
+        the next append doesn't extend it. Called with the write lock held
+        """
+        s_class = cls.__name__
+        log_path = ".db_{}.log".format(s_class)
+        if offset == 0:
+            self._log_counts[s_class] = 0
+        if not path.exists(log_path):
+            return offset
+
+        objs = self._objects(cls)
+        with open(log_path, 'rb+') as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    record = loads(line)
+                except ValueError:
+                    if not line.endswith(b"\n"):
+                        f.truncate(offset)
+                        break
+                    offset += len(line)
+                    continue
+                previous = objs.get(record['id'])
+                if previous is not None:
+                    self._index_discard(previous)
+                    del objs[record['id']]
+                if record.get('op') == 'put':
+                    obj = cls(**record['obj'])
+                    objs[obj.id] = obj
+                    self._index_add(obj)
+                self._bump(cls)
+                if changes:
+                    cls.change_log().append(
+                        'put' if record.get('op') == 'put' else 'delete',
+                        record['id'])
+                offset += len(line)
+                self._log_counts[s_class] = \
+                    self._log_counts.get(s_class, 0) + 1
+        return offset
+
+    @locked
+    def _append_log(self, cls: type, records: List[dict]):
+        """ Append mutation records to the log of cls
+        """
+        s_class = cls.__name__
+        f = self._log_files.get(s_class)
+        if f is None:
+            f = open(".db_{}.log".format(s_class), 'a+')
+            self._log_files[s_class] = f
+        # A failed append may have left a torn record: end it so it
+        # doesn't swallow the next record
+        size = os.fstat(f.fileno()).st_size
+        if size > 0 and os.pread(f.fileno(), 1, size - 1) != b"\n":
+            f.write("\n")
+        f.write("".join(dumps(record) + "\n" for record in records))
+        f.flush()
+        if DB_FSYNC == 'always':
+            os.fsync(f.fileno())
+
+        count = self._log_counts.get(s_class, 0) + len(records)
+        self._log_counts[s_class] = count
+        if count >= LOG_COMPACT_THRESHOLD:
+            self.compact(cls)
+
+    @locked
+    def compact(self, cls: type):
+        """ Write a snapshot of all objects and empty the mutation log
+
+        Replaying the log is idempotent, so a crash between the snapshot
+        and the truncation loses nothing
+        """
+        s_class = cls.__name__
+        self.flush(cls)
+        f = self._log_files.pop(s_class, None)
+        if f is not None:
+            f.close()
+        with open(".db_{}.log".format(s_class), 'w'):
+            pass
+        self._log_counts[s_class] = 0
+
+    def _persist(self, op: str, obj: TypeVar('Base')):
+        """ Persist one mutation according to STORAGE_MODE, or queue it
+        until the end of the current batch
+        """
+        cls = obj.__class__
+        batch = self._batches.get(cls.__name__)
+        if STORAGE_MODE == 'log':
+            record = {'op': op, 'id': obj.id}
+            if op == 'put':
+                record['obj'] = obj.to_json(True)
+            if batch is not None:
+                batch['records'].append(record)
+            else:
+                self._append_log(cls, [record])
+        elif batch is not None:
+            batch['dirty'] = True
+        else:
+            self._flush_file(cls)
+
+    def _flush_file(self, cls: type):
+        """ Rewrite the file, folding in the mutation log if needed
+        """
+        if self._log_counts.get(cls.__name__):
+            self.compact(cls)
+        else:
+            self.flush(cls)
+
+    @contextmanager
+    def batch(self, cls: type):
+        """ Defer persistence of cls until the end of the block
+
+        Objects saved or removed inside the block are persisted once on
+        exit, even if the block raises: one file rewrite, or one log
+        append. Batches can be nested, the outermost one persists.
+        The write lock of the class is held for the whole block.
+        """
+        s_class = cls.__name__
+        with self.lock(cls):
+            if s_class in self._batches:
+                yield
+                return
+
+            batch = {'records': [], 'dirty': False}
+            self._batches[s_class] = batch
+            try:
+                yield
+            finally:
+                del self._batches[s_class]
+                if len(batch['records']) > 0:
+                    self._append_log(cls, batch['records'])
+                if batch['dirty']:
+                    self._flush_file(cls)
+
+    def _file_changed(self, cls: type) -> bool:
+        """ Check if another process changed the files since the last sync
+        """
+        s_class = cls.__name__
+        state = self._file_states.get(s_class)
+        return state is None or \
+            state['snapshot'] != stat_key(snapshot_path(s_class)) or\
+            state['log'] != stat_key(".db_{}.log".format(s_class))
+
+    def _refresh(self, cls: type):
+        """ With DB_SHARED, catch up with the changes of other processes
+        """
+        if DB_SHARED and self._file_changed(cls):
+            with self.lock(cls):
+                pass
+
+    def _sync(self, cls: type):
+        """ Catch up with the files: replay only the new log records if
+        the snapshot didn't change and the log only grew, recording them
+        in the change log, reload everything otherwise (which starts a
+        new change log). Called with the write lock held
+        """
+        s_class = cls.__name__
+        if not self._file_changed(cls):
+            return
+        state = self._file_states.get(s_class)
+        log = stat_key(".db_{}.log".format(s_class))
+        if state is None or s_class not in self.objects or \
+                state['snapshot'] != stat_key(snapshot_path(s_class)) \
+                or log is None or state['log'] is None or \
+                log[0] != state['log'][0] or log[2] < state['offset']:
+            self.load(cls)
+        else:
+            state['offset'] = self._replay_log(cls, state['offset'],
+                                               True)
+            state['log'] = log
+
+    def _record_file_state(self, cls: type):
+        """ Remember the files as this process left them
+        """
+        s_class = cls.__name__
+        log = stat_key(".db_{}.log".format(s_class))
+        self._file_states[s_class] = {
+            'snapshot': stat_key(snapshot_path(s_class)),
+            'log': log,
+            'offset': 0 if log is None else log[2]
+        }
+
+    def _is_stored(self, obj: TypeVar('Base')) -> bool:
+        """ Check if this exact instance is the stored one, without
+        building lazily loaded objects
+        """
+        objs = self.objects.get(obj.__class__.__name__, {})
+        if isinstance(objs, RecordStore):
+            return objs.built(getattr(obj, 'id', None)) is obj
+        return super()._is_stored(obj)
+
+    def _snapshot(self, cls: type) -> List[TypeVar('Base')]:
+        """ Return a list of all objects, building lazily loaded ones
+        """
+        objs = self._objects(cls)
+        if isinstance(objs, RecordStore):
+            return objs.snapshot()
+        return list(objs.values())
+
+    def _peek(self, cls: type, obj_id: str, attr: str):
+        """ Return one attribute of a stored object, without building it
+        if it's lazily loaded
+        """
+        objs = self._objects(cls)
+        if isinstance(objs, RecordStore):
+            return objs.peek(obj_id, attr)
+        return super()._peek(cls, obj_id, attr)
+
+    def _stored_indexes(self, cls: type) -> BinaryStore:
+        """ Return the BinaryStore of cls if its snapshot has all the
+        indexes of cls, None otherwise
+        """
+        objs = self._objects(cls)
+        if isinstance(objs, BinaryStore) and objs.has_indexes(
+                cls.index_names() + tuple(cls.ORDERED_INDEXES)):
+            return objs
+        return None
+
+    def _index_add(self, obj: TypeVar('Base'), *attrs: str):
+        """ Add an object to its indexes (all of them by default): an
+        object of a snapshot with indexes is added to all of them the
+        first time it's touched, its record no longer counts
+        """
+        stored = self._stored_indexes(obj.__class__)
+        if stored is not None and stored.touch(obj.id):
+            attrs = ()
+        super()._index_add(obj, *attrs)
+
+    def get(self, cls: type, obj_id: str) -> TypeVar('Base'):
+        """ Return one object by ID
+        """
+        self._refresh(cls)
+        return super().get(cls, obj_id)
+
+    def count(self, cls: type) -> int:
+        """ Count all objects
+        """
+        self._refresh(cls)
+        return super().count(cls)
+
+    def version(self, cls: type) -> str:
+        """ Return a token of the state of all objects of cls
+        """
+        self._refresh(cls)
+        return super().version(cls)
+
+    def search(self, cls: type, attributes: dict) -> List[TypeVar('Base')]:
+        """ Search all objects with matching attributes
+        """
+        self._refresh(cls)
+        return super().search(cls, attributes)
+
+    def search_range(self, cls: type, attr: str, start=None, end=None,
+                     limit: int = None) -> List[TypeVar('Base')]:
+        """ Return at most limit objects with start <= attr < end, ordered
+        by attr then id
+        """
+        self._refresh(cls)
+        return super().search_range(cls, attr, start, end, limit)
+
+    def page(self, cls: type, limit: int,
+             after: str = None) -> List[TypeVar('Base')]:
+        """ Return at most limit objects ordered by id, starting after
+        the id after
+        """
+        self._refresh(cls)
+        return super().page(cls, limit, after)
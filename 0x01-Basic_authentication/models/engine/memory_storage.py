@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+""" MemoryStorage module
+"""
+from bisect import bisect_left, bisect_right, insort
+from functools import wraps
+from heapq import merge
+from itertools import islice
+from typing import Callable, List, TypeVar
+import os
+import threading
+from models.engine.storage import Range, Storage, compile_predicate
+
+
+def locked(method: Callable) -> Callable:
+    """ Run a storage method holding the write lock of the class (or of
+    the class of the object) it gets
+    """
+    @wraps(method)
+    def wrapper(self, cls_or_obj, *args, **kwargs):
+        cls = cls_or_obj if isinstance(cls_or_obj, type) \
+            else cls_or_obj.__class__
+        with self.lock(cls):
+            return method(self, cls_or_obj, *args, **kwargs)
+    return wrapper
+
+
+class MemoryStorage(Storage):
+    """ Storage engine keeping objects in memory only
+
+    Objects of each class are in a dict by id. Secondary indexes
+    (INDEXES, UNIQUE_INDEXES) map values to ids; ordered indexes
+    (ORDERED_INDEXES) are sorted lists of (value, id), None values left
+    out. Both are built on first use and kept in sync by put, delete and
+    set_attribute. Objects loaded with indexes of their own (see
+    _stored_indexes) are only in these once they're touched.
+
+    Writes hold a reentrant lock per class. Reads don't lock, they work
+    on list snapshots, which are atomic under the GIL.
+
+    Each class has a write counter, its version is the counter prefixed
+    by an epoch random to the storage, so versions of two storages (or
+    two runs) never match.
+    """
+
+    def __init__(self):
+        """ Initialize an empty storage
+        """
+        self.objects = {}
+        self.indexes = {}
+        self.ordered = {}
+        self.versions = {}
+        self._epoch = os.urandom(4).hex()
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def _new_lock(self, cls: type):
+        """ Create the write lock of cls
+        """
+        return threading.RLock()
+
+    def lock(self, cls: type):
+        """ Return the write lock of cls
+        """
+        s_class = cls.__name__
+        lock = self._locks.get(s_class)
+        if lock is None:
+            with self._locks_lock:
+                lock = self._locks.get(s_class)
+                if lock is None:
+                    lock = self._new_lock(cls)
+                    self._locks[s_class] = lock
+        return lock
+
+    def _objects(self, cls: type) -> dict:
+        """ Return the objects of cls by id
+        """
+        s_class = cls.__name__
+        objs = self.objects.get(s_class)
+        if objs is None:
+            objs = self.objects.setdefault(s_class, {})
+        return objs
+
+    def version(self, cls: type) -> str:
+        """ Return a token of the state of all objects of cls
+        """
+        return "{}-{}".format(self._epoch, self.versions.get(cls.__name__, 0))
+
+    def _bump(self, cls: type):
+        """ Record a change of the objects of cls, with its lock held
+        """
+        s_class = cls.__name__
+        self.versions[s_class] = self.versions.get(s_class, 0) + 1
+
+    @locked
+    def load(self, cls: type):
+        """ Start with no object, and a new change log
+        """
+        s_class = cls.__name__
+        self.objects[s_class] = {}
+        self.indexes.pop(s_class, None)
+        self.ordered.pop(s_class, None)
+        self._bump(cls)
+        cls.change_log().reset()
+
+    def flush(self, cls: type):
+        """ Nothing to persist
+        """
+        pass
+
+    def _persist(self, op: str, obj: TypeVar('Base')):
+        """ Persist one mutation ('put' or 'del'), nothing to do here
+        """
+        pass
+
+    def _stored_indexes(self, cls: type):
+        """ Return the objects of cls if they come with all the indexes of
+        cls, None otherwise: here they never do
+
+        Such objects have the methods index_ids(attr, value),
+        index_keys(attr, start, end), which answer for the untouched
+        objects, and touched(), the ids of the other ones
+        """
+        return None
+
+    @locked
+    def put(self, obj: TypeVar('Base')):
+        """ Insert or replace an object
+        """
+        cls = obj.__class__
+        for attr in cls.UNIQUE_INDEXES:
+            self._check_unique(cls, attr, getattr(obj, attr, None), obj.id)
+        objs = self._objects(cls)
+        previous = objs.get(obj.id)
+        version = obj._version
+        if previous is not None:
+            version = max(version, previous._version)
+            self._index_discard(previous)
+        obj._version = version + 1
+        objs[obj.id] = obj
+        self._index_add(obj)
+        self._bump(cls)
+        self._persist('put', obj)
+
+    @locked
+    def delete(self, obj: TypeVar('Base')) -> bool:
+        """ Remove an object, if it exists
+        """
+        objs = self._objects(obj.__class__)
+        stored = objs.get(obj.id)
+        if stored is None:
+            return False
+        obj._version = max(obj._version, stored._version) + 1
+        self._index_discard(stored)
+        del objs[obj.id]
+        self._bump(obj.__class__)
+        self._persist('del', stored)
+        return True
+
+    def set_attribute(self, obj: TypeVar('Base'), name: str, value):
+        """ Set an indexed attribute, moving a stored object in its indexes
+        """
+        if not self._is_stored(obj):
+            object.__setattr__(obj, name, value)
+            return
+
+        with self.lock(obj.__class__):
+            if not self._is_stored(obj):
+                object.__setattr__(obj, name, value)
+                return
+            self._check_unique(obj.__class__, name, value, obj.id)
+            self._index_discard(obj, name)
+            object.__setattr__(obj, name, value)
+            self._index_add(obj, name)
+
+    def _is_stored(self, obj: TypeVar('Base')) -> bool:
+        """ Check if this exact instance is the stored one
+        """
+        objs = self.objects.get(obj.__class__.__name__, {})
+        return objs.get(getattr(obj, 'id', None)) is obj
+
+    def get(self, cls: type, obj_id: str) -> TypeVar('Base'):
+        """ Return one object by ID
+        """
+        return self._objects(cls).get(obj_id)
+
+    def count(self, cls: type) -> int:
+        """ Count all objects
+        """
+        return len(self._objects(cls))
+
+    def _snapshot(self, cls: type) -> List[TypeVar('Base')]:
+        """ Return a list of all objects, safe to iterate while other
+        threads put or delete objects
+        """
+        return list(self._objects(cls).values())
+
+    def search(self, cls: type, attributes: dict) -> List[TypeVar('Base')]:
+        """ Search all objects with matching attributes
+
+        Uses the smallest matching bucket of the secondary indexes of
+        the attributes, or the ordered index of a Range, falls back to a
+        scan of all objects otherwise; candidates are checked with a
+        compiled predicate
+        """
+        objs = self._objects(cls)
+        obj_ids = None
+        table = self._index_table(cls)
+        stored = self._stored_indexes(cls)
+        for k, v in attributes.items():
+            if k not in table or type(v) is Range:
+                continue
+            try:
+                bucket = list(table[k].get(v, {}))
+            except TypeError:
+                continue
+            if stored is not None:
+                bucket += stored.index_ids(k, v)
+            if obj_ids is None or len(bucket) < len(obj_ids):
+                obj_ids = bucket
+        for k, v in attributes.items():
+            if obj_ids is None and type(v) is Range and \
+                    k in cls.ORDERED_INDEXES:
+                # Includes values equal to after, the predicate drops them
+                obj_ids = [obj_id for _, obj_id in self._range_keys(
+                    cls, k, v.after, v.before)]
+        if obj_ids is None:
+            candidates = self._snapshot(cls)
+        else:
+            candidates = [objs.get(obj_id) for obj_id in obj_ids]
+            candidates = [obj for obj in candidates if obj is not None]
+
+        if len(attributes) == 0:
+            return candidates
+        return list(filter(compile_predicate(attributes), candidates))
+
+    def _range_keys(self, cls: type, attr: str, start=None, end=None,
+                    limit: int = None) -> list:
+        """ Return the (value, id) of the ordered index of attr with
+        start <= value < end, in O(log n + k)
+        """
+        keys = self._ordered_table(cls)[attr]
+        low = 0 if start is None else bisect_left(keys, (start,))
+        high = len(keys) if end is None else bisect_left(keys, (end,))
+        stored = self._stored_indexes(cls)
+        if stored is not None:
+            return list(islice(merge(keys[low:high],
+                                     stored.index_keys(attr, start, end)),
+                               limit))
+        if limit is not None:
+            high = min(high, low + limit)
+        return keys[low:high]
+
+    def search_range(self, cls: type, attr: str, start=None, end=None,
+                     limit: int = None) -> List[TypeVar('Base')]:
+        """ Return at most limit objects with start <= attr < end, ordered
+        by attr then id, from the ordered index of attr if it has one
+        """
+        if attr not in cls.ORDERED_INDEXES:
+            return super().search_range(cls, attr, start, end, limit)
+        objs = self._objects(cls)
+        found = [objs.get(obj_id)
+                 for _, obj_id in self._range_keys(cls, attr, start, end,
+                                                   limit)]
+        return [obj for obj in found if obj is not None]
+
+    def page(self, cls: type, limit: int,
+             after: str = None) -> List[TypeVar('Base')]:
+        """ Return at most limit objects ordered by id, starting after
+        the id after
+        """
+        objs = self._objects(cls)
+        keys = self._range_keys(cls, 'id', after, None, limit + 1)
+        if len(keys) > 0 and keys[0][1] == after:
+            del keys[0]
+        page = [objs.get(obj_id) for _, obj_id in keys[:limit]]
+        return [obj for obj in page if obj is not None]
+
+    def _peek(self, cls: type, obj_id: str, attr: str):
+        """ Return one attribute of a stored object
+        """
+        return getattr(self._objects(cls)[obj_id], attr, None)
+
+    def _index_table(self, cls: type) -> dict:
+        """ Return the indexes of cls: {attr: {value: {id: None}}}
+        """
+        table = self.indexes.get(cls.__name__)
+        if table is None:
+            table = self._build_index_table(cls)
+        return table
+
+    @locked
+    def _build_index_table(self, cls: type) -> dict:
+        """ Build the indexes of cls, unless another thread did
+        """
+        s_class = cls.__name__
+        table = self.indexes.get(s_class)
+        if table is None:
+            table = {attr: {} for attr in cls.index_names()}
+            stored = self._stored_indexes(cls)
+            obj_ids = list(self._objects(cls)) if stored is None \
+                else stored.touched()
+            for obj_id in obj_ids:
+                for attr, index in table.items():
+                    value = self._peek(cls, obj_id, attr)
+                    index.setdefault(value, {})[obj_id] = None
+            self.indexes[s_class] = table
+        return table
+
+    def _ordered_table(self, cls: type) -> dict:
+        """ Return the ordered indexes of cls:
+        {attr: sorted list of (value, id)}
+        """
+        table = self.ordered.get(cls.__name__)
+        if table is None:
+            table = self._build_ordered_table(cls)
+        return table
+
+    @locked
+    def _build_ordered_table(self, cls: type) -> dict:
+        """ Build the ordered indexes of cls, unless another thread did
+        """
+        s_class = cls.__name__
+        table = self.ordered.get(s_class)
+        if table is None:
+            table = {}
+            stored = self._stored_indexes(cls)
+            obj_ids = list(self._objects(cls)) if stored is None \
+                else stored.touched()
+            for attr in cls.ORDERED_INDEXES:
+                keys = []
+                for obj_id in obj_ids:
+                    if attr == 'id':
+                        value = obj_id
+                    else:
+                        value = self._peek(cls, obj_id, attr)
+                    if value is not None:
+                        keys.append((value, obj_id))
+                keys.sort()
+                table[attr] = keys
+            self.ordered[s_class] = table
+        return table
+
+    def _check_unique(self, cls: type, attr: str, value, obj_id: str):
+        """ Raise ValueError if a unique index already holds value
+        """
+        if attr not in cls.UNIQUE_INDEXES or value is None:
+            return
+        bucket = list(self._index_table(cls)[attr].get(value, {}))
+        stored = self._stored_indexes(cls)
+        if stored is not None:
+            bucket += stored.index_ids(attr, value)
+        if any(other_id != obj_id for other_id in bucket):
+            raise ValueError("{} {} already exists".format(attr, value))
+
+    def _index_add(self, obj: TypeVar('Base'), *attrs: str):
+        """ Add an object to its indexes (all of them by default)
+        """
+        s_class = obj.__class__.__name__
+        table = self.indexes.get(s_class, {})
+        ordered = self.ordered.get(s_class, {})
+        for attr in attrs or (tuple(table) + tuple(ordered)):
+            value = getattr(obj, attr, None)
+            if attr in table:
+                table[attr].setdefault(value, {})[obj.id] = None
+            if attr in ordered and value is not None:
+                insort(ordered[attr], (value, obj.id))
+
+    def _index_discard(self, obj: TypeVar('Base'), *attrs: str):
+        """ Remove an object from its indexes (all of them by default)
+        """
+        s_class = obj.__class__.__name__
+        table = self.indexes.get(s_class, {})
+        ordered = self.ordered.get(s_class, {})
+        for attr in attrs or (tuple(table) + tuple(ordered)):
+            value = getattr(obj, attr, None)
+            bucket = table.get(attr, {}).get(value)
+            if bucket is not None and obj.id in bucket:
+                del bucket[obj.id]
+                if len(bucket) == 0:
+                    del table[attr][value]
+            keys = ordered.get(attr)
+            if keys is not None and value is not None:
+                i = bisect_right(keys, (value, obj.id)) - 1
+                if i >= 0 and keys[i] == (value, obj.id):
+                    del keys[i]
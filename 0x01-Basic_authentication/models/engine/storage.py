@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+""" Storage module
+"""
+from contextlib import contextmanager
+from operator import attrgetter
+from typing import Callable, List, TypeVar
+
+
+class Range():
+    """ Condition of search() on an attribute: its value is strictly
+    between after and before (either can be None for no bound). None
+    values never match
+    """
+
+    def __init__(self, after=None, before=None):
+        """ Initialize a range
+        """
+        self.after = after
+        self.before = before
+
+    def __contains__(self, value) -> bool:
+        """ Check if value is in the range
+        """
+        return value is not None and \
+            (self.after is None or value > self.after) and \
+            (self.before is None or value < self.before)
+
+    def __repr__(self) -> str:
+        """ Representation of the range
+        """
+        return "Range(after={!r}, before={!r})".format(
+            self.after, self.before)
+
+
+def compile_predicate(attributes: dict) -> Callable[[object], bool]:
+    """ Build the function checking that an object matches attributes,
+    {name: value or Range}
+
+    Equalities are checked at once, comparing the tuple of the values
+    attrgetter() fetches to the expected one
+    """
+    equal = {k: v for k, v in attributes.items() if type(v) is not Range}
+    ranges = [(attrgetter(k), v) for k, v in attributes.items()
+              if type(v) is Range]
+    checks = []
+    if len(equal) == 1:
+        (name, expected), = equal.items()
+        get = attrgetter(name)
+        checks.append(lambda obj: get(obj) == expected)
+    elif len(equal) > 1:
+        get = attrgetter(*equal)
+        expected = tuple(equal.values())
+        checks.append(lambda obj: get(obj) == expected)
+    for get_value, condition in ranges:
+        checks.append(lambda obj, get=get_value, condition=condition:
+                      get(obj) in condition)
+    if len(checks) == 0:
+        return lambda obj: True
+    if len(checks) == 1:
+        return checks[0]
+    return lambda obj: all(check(obj) for check in checks)
+
+
+class Storage():
+    """ Interface of storage engines
+
+    An engine stores the objects of each model class and is selected by
+    the STORAGE_ENGINE environment variable (see models.base). Methods
+    get the model class, or the object, they work on.
+    """
+
+    def load(self, cls: type):
+        """ Load all objects of cls from the underlying storage
+        """
+        raise NotImplementedError()
+
+    def flush(self, cls: type):
+        """ Persist all objects of cls
+        """
+        raise NotImplementedError()
+
+    def get(self, cls: type, obj_id: str) -> TypeVar('Base'):
+        """ Return one object by ID, None if it doesn't exist
+        """
+        raise NotImplementedError()
+
+    def search(self, cls: type, attributes: dict) -> List[TypeVar('Base')]:
+        """ Return all objects with matching attributes: equal values,
+        or values in a Range
+        """
+        raise NotImplementedError()
+
+    def search_range(self, cls: type, attr: str, start=None, end=None,
+                     limit: int = None) -> List[TypeVar('Base')]:
+        """ Return at most limit objects with start <= attr < end (a None
+        bound isn't checked, None values never match), ordered by attr
+        then id
+
+        This default scans and sorts all objects, engines use the ordered
+        index of attr instead
+        """
+        objs = []
+        for obj in self.search(cls, {}):
+            value = getattr(obj, attr, None)
+            if value is not None and (start is None or value >= start) \
+                    and (end is None or value < end):
+                objs.append((value, obj.id, obj))
+        objs.sort(key=lambda item: item[:2])
+        return [obj for _, _, obj in objs[:limit]]
+
+    def count(self, cls: type) -> int:
+        """ Count all objects
+        """
+        raise NotImplementedError()
+
+    def page(self, cls: type, limit: int,
+             after: str = None) -> List[TypeVar('Base')]:
+        """ Return at most limit objects ordered by id, starting after
+        the id after
+        """
+        raise NotImplementedError()
+
+    def put(self, obj: TypeVar('Base')):
+        """ Insert or replace an object, numbered with the version after
+        the one of the stored object (or of obj, if it's greater): the
+        new version is set on obj
+        """
+        raise NotImplementedError()
+
+    def delete(self, obj: TypeVar('Base')) -> bool:
+        """ Remove an object, if it exists; obj gets the version after
+        the one of the stored object. Return False if there was none
+        """
+        raise NotImplementedError()
+
+    def lock(self, cls: type):
+        """ Return the write lock of cls, a reentrant context manager
+        """
+        raise NotImplementedError()
+
+    def version(self, cls: type) -> str:
+        """ Return a token of the state of all objects of cls: it changes
+        whenever one is put or deleted, by this process or another one.
+        None if the engine can't tell, then nothing derived from the
+        objects of cls can be cached
+        """
+        return None
+
+    @contextmanager
+    def batch(self, cls: type):
+        """ Group the writes of a block; engines may persist them at once
+        """
+        with self.lock(cls):
+            yield
+
+    def set_attribute(self, obj: TypeVar('Base'), name: str, value):
+        """ Set an attribute listed in the indexes of the class of obj
+        """
+        object.__setattr__(obj, name, value)
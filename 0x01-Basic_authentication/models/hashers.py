@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+""" Password hashers module
+"""
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from os import getenv
+from typing import Dict, Iterable, Iterator
+import hashlib
+import hmac
+import os
+import re
+import threading
+try:
+    import bcrypt
+except ImportError:
+    bcrypt = None
+try:
+    import argon2
+except ImportError:
+    argon2 = None
+
+
+BCRYPT_ROUNDS = int(getenv('PASSWORD_BCRYPT_ROUNDS', '12'))
+# Number of threads verifying and hashing slow hashes, default: one per CPU
+PASSWORD_WORKERS = int(getenv('PASSWORD_WORKERS', '0')) or \
+    os.cpu_count() or 1
+
+
+class Hasher():
+    """ Password hashing scheme
+
+    Hashes are self-describing: identifies() recognizes the hashes of
+    the scheme, so stored hashes of several schemes can coexist.
+    Slow schemes are run on the worker pool (see run()).
+    """
+    name: str = None
+    slow: bool = False
+
+    def identifies(self, hashed: str) -> bool:
+        """ Check if hashed was produced by this scheme
+        """
+        raise NotImplementedError
+
+    def hash(self, password: str) -> str:
+        """ Hash a password
+        """
+        raise NotImplementedError
+
+    def verify(self, password: str, hashed: str) -> bool:
+        """ Check a password against a hash of this scheme
+        """
+        raise NotImplementedError
+
+    def needs_update(self, hashed: str) -> bool:
+        """ Check if a valid hash of this scheme should be replaced by a
+        new one, e.g. because its cost is below the configured one
+        """
+        return False
+
+
+class SHA256Hasher(Hasher):
+    """ Legacy scheme: unsalted SHA256, stored as 64 hexadecimal digits
+    (without prefix, as the first users were stored)
+    """
+    name = 'sha256'
+    _FORMAT = re.compile(r'[0-9a-f]{64}')
+
+    def identifies(self, hashed: str) -> bool:
+        """ Check if hashed is a SHA256 hexadecimal digest
+        """
+        return self._FORMAT.fullmatch(hashed) is not None
+
+    def hash(self, password: str) -> str:
+        """ Hash a password
+        """
+        return hashlib.sha256(password.encode()).hexdigest().lower()
+
+    def verify(self, password: str, hashed: str) -> bool:
+        """ Check a password against a hash, in constant time
+        """
+        return hmac.compare_digest(self.hash(password), hashed)
+
+
+class BcryptHasher(Hasher):
+    """ bcrypt scheme, "$2b$<rounds>$<salt and hash>"
+    """
+    name = 'bcrypt'
+    slow = True
+
+    def __init__(self, rounds: int = BCRYPT_ROUNDS):
+        """ Initialize a bcrypt hasher of cost rounds
+        """
+        self.rounds = rounds
+
+    def identifies(self, hashed: str) -> bool:
+        """ Check if hashed is a bcrypt hash
+        """
+        return hashed.startswith(('$2b$', '$2a$', '$2y$'))
+
+    def hash(self, password: str) -> str:
+        """ Hash a password
+        """
+        return bcrypt.hashpw(password.encode(),
+                             bcrypt.gensalt(self.rounds)).decode()
+
+    def verify(self, password: str, hashed: str) -> bool:
+        """ Check a password against a hash
+        """
+        try:
+            return bcrypt.checkpw(password.encode(), hashed.encode())
+        except ValueError:
+            return False
+
+    def needs_update(self, hashed: str) -> bool:
+        """ Check if the hash has another cost than the configured one
+        """
+        return hashed[:4] != '$2b$' or \
+            hashed[4:6] != "{:02d}".format(self.rounds)
+
+
+class Argon2Hasher(Hasher):
+    """ argon2id scheme, "$argon2id$v=..$m=..,t=..,p=..$<salt>$<hash>"
+    """
+    name = 'argon2'
+    slow = True
+
+    def __init__(self):
+        """ Initialize an argon2 hasher with the library's parameters
+        """
+        self._hasher = argon2.PasswordHasher()
+
+    def identifies(self, hashed: str) -> bool:
+        """ Check if hashed is an argon2 hash
+        """
+        return hashed.startswith('$argon2')
+
+    def hash(self, password: str) -> str:
+        """ Hash a password
+        """
+        return self._hasher.hash(password)
+
+    def verify(self, password: str, hashed: str) -> bool:
+        """ Check a password against a hash
+        """
+        try:
+            return self._hasher.verify(hashed, password)
+        except (argon2.exceptions.VerificationError,
+                argon2.exceptions.InvalidHash):
+            return False
+
+    def needs_update(self, hashed: str) -> bool:
+        """ Check if the hash has other parameters than the configured ones
+        """
+        return self._hasher.check_needs_rehash(hashed)
+
+
+HASHERS: Dict[str, Hasher] = {}
+
+
+def register_hasher(hasher: Hasher):
+    """ Make a scheme available, under hasher.name
+    """
+    HASHERS[hasher.name] = hasher
+
+
+register_hasher(SHA256Hasher())
+if bcrypt is not None:
+    register_hasher(BcryptHasher())
+if argon2 is not None:
+    register_hasher(Argon2Hasher())
+
+# Scheme of new hashes: 'sha256', 'bcrypt', 'argon2', or 'auto' for the
+# strongest installed one (argon2, then bcrypt, then sha256)
+PASSWORD_SCHEME = getenv('PASSWORD_SCHEME', 'auto')
+if PASSWORD_SCHEME == 'auto':
+    PASSWORD_SCHEME = next(name for name in ('argon2', 'bcrypt', 'sha256')
+                           if name in HASHERS)
+elif PASSWORD_SCHEME not in HASHERS:
+    raise ValueError("Unavailable PASSWORD_SCHEME: {}".format(
+        PASSWORD_SCHEME))
+
+
+def current_hasher() -> Hasher:
+    """ Return the hasher of new hashes
+    """
+    return HASHERS[PASSWORD_SCHEME]
+
+
+def identify(hashed: str) -> Hasher:
+    """ Return the hasher of a stored hash, None if no scheme matches
+    """
+    for hasher in HASHERS.values():
+        if hasher.identifies(hashed):
+            return hasher
+    return None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def submit(hasher: Hasher, method: str, *args) -> Future:
+    """ Start a call of a method of hasher and return its Future: run on
+    the worker pool if the scheme is slow, already done otherwise
+
+    Submitting several calls before waiting for their results runs them
+    concurrently, up to PASSWORD_WORKERS at once (see submit_each)
+    """
+    if not hasher.slow:
+        future = Future()
+        try:
+            future.set_result(getattr(hasher, method)(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(PASSWORD_WORKERS,
+                                           thread_name_prefix='hasher')
+    return _pool.submit(getattr(hasher, method), *args)
+
+
+def submit_each(hasher: Hasher, method: str,
+                calls: Iterable[tuple]) -> Iterator[Future]:
+    """ Call a method of hasher with each tuple of arguments of calls and
+    yield the Futures of the calls, in order
+
+    At most PASSWORD_WORKERS calls are submitted ahead of the one whose
+    result is waited for: they run concurrently, and a hash submitted
+    meanwhile by another request waits for about one round of them, not
+    for all of them
+    """
+    pending = deque()
+    for args in calls:
+        if len(pending) >= PASSWORD_WORKERS:
+            yield pending.popleft()
+        pending.append(submit(hasher, method, *args))
+    while len(pending) > 0:
+        yield pending.popleft()
+
+
+def run(hasher: Hasher, method: str, *args):
+    """ Call a method of hasher, on the worker pool if the scheme is slow
+
+    The pool bounds how many slow hashes run at once to
+    PASSWORD_WORKERS: the hash functions release the GIL, so request
+    threads keep being served while others wait for their result
+    """
+    return submit(hasher, method, *args).result()
+
+
+_dummy_hashes: Dict[str, str] = {}
+
+
+def verify_dummy(password: str) -> bool:
+    """ Check password against a hash of the current scheme that matches
+    no password, taking as long as checking a stored hash: checking the
+    password of an unknown user this way doesn't reveal it's unknown.
+    Always returns False
+    """
+    hasher = current_hasher()
+    hashed = _dummy_hashes.get(hasher.name)
+    if hashed is None:
+        hashed = _dummy_hashes.setdefault(
+            hasher.name, run(hasher, 'hash', os.urandom(16).hex()))
+    run(hasher, 'verify', password, hashed)
+    return False
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+""" LazyStore module: .db_<Class>.json files read on demand
+
+Where each object is in the file comes from its offset index,
+.db_<Class>.idx, which is (all integers little-endian):
+  - a fixed header (HEADER): magic, format version, number of objects,
+    then the inode, modification time (ns) and size of the JSON file it
+    indexes
+  - the bounds of the records: their start and end offsets in the JSON
+    file (unsigned 64 bits), sorted by id
+  - the ids: the end offset of each (unsigned 32 bits), then their UTF-8
+    data
+
+The index is written along with the JSON file. If it's missing or was
+written for another version of the file, it's rebuilt with scan(), which
+finds the boundaries of the records in the bytes of the file without
+decoding them.
+"""
+from array import array
+from itertools import accumulate, chain
+from operator import itemgetter
+from os import path
+from typing import Iterator, List, Tuple
+import mmap
+import os
+import re
+import struct
+from models.record_store import RecordStore, array_bytes, array_view
+from models.serializer import loads
+
+
+MAGIC = b'JIDX'
+FORMAT_VERSION = 1
+# magic, format version, objects, inode, modification time and size of
+# the JSON file
+HEADER = struct.Struct('<4sHIQQQ')
+_STRING = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+_SPACE = re.compile(rb'[ \t\n\r]*')
+_KEY = re.compile(rb'[ \t\n\r]*(' + _STRING + rb')[ \t\n\r]*:[ \t\n\r]*')
+_SEPARATOR = re.compile(rb'[ \t\n\r]*([,}])[ \t\n\r]*')
+_TOKEN = re.compile(_STRING + rb'|[{}]')
+
+
+def index_path(file_path: str) -> str:
+    """ Return the offset index of a .db_<Class>.json file
+    """
+    return path.splitext(file_path)[0] + '.idx'
+
+
+def _object_end(buffer, start: int) -> int:
+    """ Return the end of the JSON object of buffer at start
+    """
+    depth = 0
+    if buffer[start:start + 1] == b'{':
+        for token in _TOKEN.finditer(buffer, start):
+            if token.group() == b'{':
+                depth += 1
+            elif token.group() == b'}':
+                depth -= 1
+                if depth == 0:
+                    return token.end()
+    raise ValueError("Expecting an object at {}".format(start))
+
+
+def scan(buffer) -> List[Tuple[str, int, int]]:
+    """ Return the (id, start, end) of each record of a .db_<Class>.json
+    file, without decoding the records
+
+    A record is usually a flat object without escapes, which ends at the
+    first '}': that's checked on its bytes, other records are walked
+    token by token
+    """
+    bounds = []
+    idx = _SPACE.match(buffer, 0).end()
+    if idx == len(buffer):
+        return bounds
+    if buffer[idx:idx + 1] != b'{':
+        raise ValueError("Expecting '{{' at {}".format(idx))
+    idx = _SPACE.match(buffer, idx + 1).end()
+    if buffer[idx:idx + 1] == b'}':
+        return bounds
+    while True:
+        key = _KEY.match(buffer, idx)
+        if key is None:
+            raise ValueError("Expecting an id at {}".format(idx))
+        start = key.end()
+        end = buffer.find(b'}', start) + 1
+        text = buffer[start:end]
+        if not text.startswith(b'{') or b'\\' in text or \
+                text.find(b'{', 1) >= 0 or text.count(b'"') % 2 != 0:
+            end = _object_end(buffer, start)
+        obj_id = key.group(1)
+        if b'\\' in obj_id:
+            obj_id = loads(obj_id)
+        else:
+            obj_id = str(obj_id[1:-1], 'utf-8')
+        bounds.append((obj_id, start, end))
+        separator = _SEPARATOR.match(buffer, end)
+        if separator is None:
+            raise ValueError("Expecting ',' at {}".format(end))
+        if separator.group(1) == b'}':
+            return bounds
+        idx = separator.end()
+
+
+def _index_data(key: tuple, bounds: List[Tuple[str, int, int]]) -> bytes:
+    """ Return the offset index of a file with the stat key (inode,
+    modification time, size) and records bounds
+    """
+    bounds = sorted(bounds, key=itemgetter(0))
+    ids = [obj_id.encode('utf-8') for obj_id, _, _ in bounds]
+    offsets = array('Q', chain.from_iterable(
+        (start, end) for _, start, end in bounds))
+    ends = array('I', accumulate(map(len, ids)))
+    return b"".join([HEADER.pack(MAGIC, FORMAT_VERSION, len(bounds), *key),
+                     array_bytes(offsets), array_bytes(ends)] + ids)
+
+
+def _write(file_path: str, data: bytes):
+    """ Write a file next to its destination then rename it over it
+    """
+    tmp_path = "{}.{}.tmp".format(file_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, file_path)
+
+
+def write_index(file_path: str, bounds: List[Tuple[str, int, int]]):
+    """ Write the offset index of the JSON file file_path, given the
+    (id, start, end) of its records
+    """
+    st = os.stat(file_path)
+    _write(index_path(file_path),
+           _index_data((st.st_ino, st.st_mtime_ns, st.st_size), bounds))
+
+
+class JsonFile():
+    """ Reader of a memory mapped .db_<Class>.json file, through its
+    offset index
+
+    Opening it maps the file and its index and only reads the header of
+    the index: ids and records are read from the mappings when they're
+    asked for
+    """
+
+    def __init__(self, file_path: str):
+        """ Map file_path and its index, rebuilding the index if it
+        doesn't match the file
+        """
+        with open(file_path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            self._buffer = b""
+            if st.st_size > 0:
+                self._buffer = mmap.mmap(f.fileno(), 0,
+                                         access=mmap.ACCESS_READ)
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        try:
+            with open(index_path(file_path), 'rb') as f:
+                index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._map_index(index, key)
+        except (OSError, ValueError):
+            index = _index_data(key, scan(self._buffer))
+            try:
+                _write(index_path(file_path), index)
+            except OSError:
+                pass
+            self._map_index(index, key)
+
+    def _map_index(self, index, key: tuple):
+        """ Read the header of an index, checking it's the one of the file
+        with the stat key
+        """
+        if len(index) < HEADER.size:
+            raise ValueError("Not an offset index")
+        magic, version, self.count, *indexed = HEADER.unpack_from(index)
+        if magic != MAGIC or version != FORMAT_VERSION or \
+                tuple(indexed) != key:
+            raise ValueError("Offset index of another file")
+        if len(index) < HEADER.size + 20 * self.count:
+            raise ValueError("Truncated offset index")
+        self._bounds = array_view(index, HEADER.size, 2 * self.count, 'Q')
+        self._ends = array_view(index, HEADER.size + 16 * self.count,
+                                self.count)
+        self._data_offset = HEADER.size + 20 * self.count
+        size = self._ends[-1] if self.count > 0 else 0
+        if len(index) != self._data_offset + size:
+            raise ValueError("Truncated offset index")
+        self._index = index
+
+    def id_at(self, position: int) -> str:
+        """ Return the id of the record at position
+        """
+        start = self._data_offset
+        if position > 0:
+            start += self._ends[position - 1]
+        end = self._data_offset + self._ends[position]
+        return str(self._index[start:end], 'utf-8')
+
+    def find(self, obj_id: str) -> int:
+        """ Return the position of the record of obj_id, -1 if there is
+        none, in O(log n)
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.id_at(middle) < obj_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.id_at(low) == obj_id:
+            return low
+        return -1
+
+    def ids(self) -> List[str]:
+        """ Return the ids of all records, in order
+        """
+        ends = self._ends.tolist()
+        size = ends[-1] if len(ends) > 0 else 0
+        data = self._index[self._data_offset:self._data_offset + size]
+        if data.isascii():
+            text = data.decode('ascii')
+            return [text[start:end] for start, end in zip([0] + ends, ends)]
+        return [str(data[start:end], 'utf-8')
+                for start, end in zip([0] + ends, ends)]
+
+    def text(self, position: int) -> str:
+        """ Return the JSON text of the record at position
+        """
+        start, end = self._bounds[2 * position:2 * position + 2]
+        return str(self._buffer[start:end], 'utf-8')
+
+    def record(self, position: int) -> dict:
+        """ Return the JSON dictionary of the record at position
+        """
+        start, end = self._bounds[2 * position:2 * position + 2]
+        return loads(self._buffer[start:end])
+
+    def value(self, position: int, field: str):
+        """ Return one field of the record at position, None if it's
+        missing
+        """
+        return self.record(position).get(field)
+
+
+class LazyStore(RecordStore):
+    """ Objects of one class, read from a .db_<Class>.json file on demand
+
+    Loading maps the file and its offset index, without reading the
+    records: an object is decoded and built the first time it's accessed
+    (see RecordStore)
+    """
+
+    def __init__(self, cls: type, file_path: str):
+        """ Map file_path and its offset index
+        """
+        super().__init__(cls, JsonFile(file_path))
+
+    def json_items(self) -> Iterator[Tuple[str, str]]:
+        """ Yield the (id, JSON text) of all objects: objects not built
+        yet are copied from the file as they are, without building them
+        """
+        removed = self._removed
+        for position, obj_id in enumerate(self.file_ids()):
+            if obj_id not in removed:
+                obj = self._built.get(obj_id)
+                yield obj_id, self._file.text(position) if obj is None \
+                    else obj.to_json_text(True)
+        for obj_id in list(self._added):
+            obj = self._built.get(obj_id)
+            if obj is not None:
+                yield obj_id, obj.to_json_text(True)
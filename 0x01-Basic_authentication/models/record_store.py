@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+""" RecordStore module: objects of a class read on demand from a file of
+records sorted by id, the base of LazyStore and BinaryStore
+"""
+from array import array
+from collections.abc import MutableMapping
+from datetime import datetime
+from typing import Iterator, List, TypeVar
+import sys
+import threading
+
+
+_LITTLE_ENDIAN = sys.byteorder == 'little'
+
+
+def array_bytes(values: array) -> bytes:
+    """ Return the little-endian bytes of an array of integers
+    """
+    if not _LITTLE_ENDIAN:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def array_view(buffer, start: int, count: int, typecode: str = 'I'):
+    """ Return the count integers of typecode of buffer at start, without
+    copying them if the machine is little-endian
+    """
+    size = array(typecode).itemsize
+    view = memoryview(buffer)[start:start + size * count]
+    if _LITTLE_ENDIAN:
+        return view.cast(typecode)
+    values = array(typecode, view)
+    values.byteswap()
+    return values
+
+
+class RecordStore(MutableMapping):
+    """ Objects of one class, read on demand from a file of records
+
+    The records file is sorted by id and never written to; it has a count
+    of records and the methods id_at(position), find(id), ids(),
+    record(position) and value(position, field). An object is decoded and
+    built the first time it's accessed. Objects put or removed since the
+    file was read are kept apart. Peeked TIMESTAMPS of the class are
+    parsed into datetimes, as the built objects have them.
+    """
+
+    def __init__(self, cls: type, records):
+        """ Initialize the store of cls over a records file
+        """
+        self._cls = cls
+        self._file = records
+        # Objects built or put, ids of the file removed, ids put that
+        # aren't in the file
+        self._built = {}
+        self._removed = set()
+        self._added = set()
+        # Position of the last record found: iterations look records up
+        # in order, the next one is checked before a bisection
+        self._hint = -1
+        # The ids of the file, decoded on first use
+        self._ids = None
+        self._build_lock = threading.Lock()
+
+    def _position(self, obj_id: str) -> int:
+        """ Return the position of the record of obj_id, -1 if there is
+        none or it was removed
+        """
+        if obj_id in self._removed or type(obj_id) is not str:
+            return -1
+        hint = self._hint + 1
+        if 0 <= hint < self._file.count and \
+                self._file.id_at(hint) == obj_id:
+            position = hint
+        else:
+            position = self._file.find(obj_id)
+        self._hint = position
+        return position
+
+    def __getitem__(self, obj_id: str) -> TypeVar('Base'):
+        """ Return an object, building it on first access
+        """
+        obj = self._built.get(obj_id)
+        if obj is not None:
+            return obj
+        with self._build_lock:
+            obj = self._built.get(obj_id)
+            if obj is None:
+                position = self._position(obj_id)
+                if position < 0:
+                    raise KeyError(obj_id)
+                obj = self._cls(**self._file.record(position))
+                self._built[obj_id] = obj
+        return obj
+
+    def __setitem__(self, obj_id: str, obj: TypeVar('Base')):
+        """ Store an object
+        """
+        if obj_id not in self._built and self._position(obj_id) < 0:
+            self._added.add(obj_id)
+        self._built[obj_id] = obj
+
+    def __delitem__(self, obj_id: str):
+        """ Remove an object
+        """
+        if obj_id in self._added:
+            self._added.discard(obj_id)
+            del self._built[obj_id]
+            return
+        if self._position(obj_id) < 0:
+            raise KeyError(obj_id)
+        self._built.pop(obj_id, None)
+        self._removed.add(obj_id)
+
+    def __contains__(self, obj_id) -> bool:
+        """ Check if an object exists, without building it
+        """
+        return obj_id in self._built or self._position(obj_id) >= 0
+
+    def file_ids(self) -> List[str]:
+        """ Return the ids of the records of the file, in order, decoded
+        once
+        """
+        ids = self._ids
+        if ids is None:
+            ids = self._ids = self._file.ids()
+        return ids
+
+    def __iter__(self) -> Iterator[str]:
+        """ Iterate over the ids of all objects
+        """
+        removed = self._removed
+        if len(removed) == 0:
+            ids = self.file_ids()
+        else:
+            ids = [obj_id for obj_id in self.file_ids()
+                   if obj_id not in removed]
+        return iter(ids + list(self._added))
+
+    def __len__(self) -> int:
+        """ Count all objects
+        """
+        return self._file.count - len(self._removed) + len(self._added)
+
+    def snapshot(self) -> list:
+        """ Return a list of all objects, building them, that ignores
+        objects removed meanwhile
+        """
+        objs = []
+        for obj_id in list(self):
+            try:
+                objs.append(self[obj_id])
+            except KeyError:
+                pass
+        return objs
+
+    def built(self, obj_id: str) -> TypeVar('Base'):
+        """ Return an object if it's already built, None otherwise
+        """
+        return self._built.get(obj_id)
+
+    def peek(self, obj_id: str, attr: str):
+        """ Return one attribute of an object without building it
+        """
+        obj = self._built.get(obj_id)
+        if obj is not None:
+            return getattr(obj, attr, None)
+        position = self._position(obj_id)
+        if position < 0:
+            raise KeyError(obj_id)
+        value = self._file.value(position, attr)
+        if attr in self._cls.TIMESTAMPS and value is not None:
+            value = datetime.fromisoformat(value)
+        return value
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+""" Serializer module
+"""
+from datetime import datetime
+from os import getenv
+from typing import Iterable
+import json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+# 'auto': orjson if it's installed, 'json': always the standard library
+JSON_BACKEND = getenv('JSON_BACKEND', 'auto')
+if JSON_BACKEND == 'json':
+    orjson = None
+# json.dumps() with arguments builds a new encoder on every call
+_ENCODER = json.JSONEncoder(separators=(',', ':'), sort_keys=True)
+
+
+def format_timestamp(value: datetime) -> str:
+    """ Format a datetime with TIMESTAMP_FORMAT
+
+    isoformat() is several times faster than strftime() and gives the
+    same text for naive datetimes
+    """
+    if value.tzinfo is None:
+        return value.isoformat(timespec='seconds')
+    return value.strftime(TIMESTAMP_FORMAT)
+
+
+def dumps(value) -> str:
+    """ Encode value as compact JSON with sorted keys, the same text
+    as flask.jsonify (without its trailing newline)
+
+    The text is ASCII only: orjson output with non-ASCII characters, or
+    values orjson can't encode, go through the standard library
+    """
+    if orjson is not None:
+        try:
+            text = orjson.dumps(value, option=orjson.OPT_SORT_KEYS).decode()
+            if text.isascii():
+                return text
+        except TypeError:
+            pass
+    return _ENCODER.encode(value)
+
+
+def loads(text):
+    """ Decode a JSON text (str or bytes)
+    """
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def dumps_list(texts: Iterable[str]) -> str:
+    """ JSON list of already encoded items
+    """
+    return "[" + ",".join(texts) + "]"
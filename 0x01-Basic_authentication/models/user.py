@@ -1,13 +1,21 @@
 #!/usr/bin/env python3
 """ User module
 """
-import hashlib
-from models.base import Base
+from models import hashers
+from models.base import Base, MODEL_LAYOUT
 
 
 class User(Base):
     """ User class
+
+    Passwords are hashed with the scheme of PASSWORD_SCHEME (see
+    models.hashers); hashes of other schemes, or of an outdated cost,
+    are replaced on the next successful login.
     """
+    INDEXES = ('email',)
+    FIELDS = Base.FIELDS + ('email', '_password', 'first_name', 'last_name')
+    if MODEL_LAYOUT == 'slots':
+        __slots__ = FIELDS[len(Base.FIELDS):]
 
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User instance
@@ -26,22 +34,44 @@ class User(Base):
 
     @password.setter
     def password(self, pwd: str):
-        """ Setter of a new password: encrypt in SHA256
+        """ Setter of a new password: hash it with the current scheme
         """
         if pwd is None or type(pwd) is not str:
             self._password = None
         else:
-            self._password = hashlib.sha256(pwd.encode()).hexdigest().lower()
+            hasher = hashers.current_hasher()
+            self._password = hashers.run(hasher, 'hash', pwd)
 
     def is_valid_password(self, pwd: str) -> bool:
         """ Validate a password
         """
         if pwd is None or type(pwd) is not str:
             return False
-        if self.password is None:
+        hashed = self.password
+        hasher = hashers.identify(hashed) if hashed is not None else None
+        if hasher is None:
+            return False
+        if not hashers.run(hasher, 'verify', pwd, hashed):
             return False
-        pwd_e = pwd.encode()
-        return hashlib.sha256(pwd_e).hexdigest().lower() == self.password
+        if hasher is not hashers.current_hasher() or \
+                hasher.needs_update(hashed):
+            self.rehash_password(pwd, hashed)
+        return True
+
+    def rehash_password(self, pwd: str, previous: str):
+        """ Replace the verified hash previous of pwd by a hash of the
+        current scheme, saved if the user is stored
+
+        Nothing changes if the password was changed meanwhile. The new
+        hash is computed before taking the write lock
+        """
+        hashed = hashers.run(hashers.current_hasher(), 'hash', pwd)
+        with User.lock():
+            if self._password != previous:
+                return
+            self._password = hashed
+            if User.get(self.id) is not None:
+                self.save()
 
     def display_name(self) -> str:
         """ Display User name based on email/first_name/last_name